@@ -1,126 +1,530 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import recordlinkage as rl
 from recordlinkage.index import Block
-from recordlinkage.base import BaseCompareFeature
+from recordlinkage.base import BaseCompareFeature, BaseIndexAlgorithm
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+
+import instrumentation
+from string_similarity import CompareCachedString
+
+# columns compared with CompareEuclideanDistance, midpoints of the generalized ranges
+numeric_columns = ['postcode_mid', 'street_number_mid', 'date_of_birth_mid']
+# generalized range written by the Mondrian anonymization, e.g. [2000-2150]
+range_pattern = r'^\[\s*(-?\d+)\s*-\s*(-?\d+)\s*\]$'
+# blocking of block_records, 'block' agrees on a postcode bound, 'interval' on any overlapping postcode range
+blocking_methods = ['block', 'interval']
+# feature names of compare_records
+variable_names = ['postcode', 'street_number', 'date_of_birth', 'state', 'salary-class']
+# datasets of a comparison worker, set once by init_compare_worker
+_COMPARE_DATA = None
 
 def load_data(file_a, file_b):
     df_a = pd.read_csv(file_a)
     df_b = pd.read_csv(file_b)
     return df_a, df_b
 
+@instrumentation.timed("index.load")
+def load_anonymized(file_a, file_b):
+    # load the Mondrian output of both datasets and parse the generalized columns once,
+    # a folder is the binary output of the anonymization and is memory-mapped instead
+    if os.path.isdir(file_a) and os.path.isdir(file_b):
+        df_a, df_b = share_vocabulary(load_bundle(file_a), load_bundle(file_b))
+    else:
+        df_a, df_b = parse_generalized(*load_data(file_a, file_b))
+    instrumentation.count_rows(len(df_a) + len(df_b))
+    return df_a, df_b
+
+def load_bundle(folder):
+    # columns written by FileHandle.dump_bundle, with the same typed columns as parse_generalized.
+    # the numeric columns of the frame are the memory-mapped files themselves, only the text columns
+    # are read into memory, pandas keeps strings as objects
+    data = {}
+    attrs = {}
+    for name in np.load(os.path.join(folder, 'columns.npy')).tolist():
+        path = os.path.join(folder, name)
+        if os.path.exists(path + '_min.npy'):
+            low = np.load(path + '_min.npy', mmap_mode='r')
+            high = np.load(path + '_max.npy', mmap_mode='r')
+            data[name + '_min'] = low
+            data[name + '_max'] = high
+            if os.path.exists(path + '_mid.npy'):
+                data[name + '_mid'] = np.load(path + '_mid.npy', mmap_mode='r')
+            else:
+                data[name + '_mid'] = ((low + high) / 2).astype(np.int64)
+        elif os.path.exists(path + '_mask.npy'):
+            mask = np.load(path + '_mask.npy', mmap_mode='r')
+            data.update(zip(mask_columns(name, mask.shape[1]), mask.T))
+            attrs[name + '_vocabulary'] = np.load(path + '_vocabulary.npy').tolist()
+        else:
+            data[name] = np.load(path + '.npy', mmap_mode='r')
+    # without a copy the columns are not consolidated into new blocks
+    df = pd.DataFrame(data, copy=False)
+    df.attrs.update(attrs)
+    return df
+
+def share_vocabulary(*frames):
+    # remap the set bitmasks of the frames onto one sorted vocabulary
+    columns = [key[:-len('_vocabulary')] for key in frames[0].attrs if key.endswith('_vocabulary')]
+    for column in columns:
+        vocabulary = sorted(set().union(*(df.attrs[column + '_vocabulary'] for df in frames)))
+        positions = {item: position for position, item in enumerate(vocabulary)}
+        for df in frames:
+            if df.attrs[column + '_vocabulary'] == vocabulary:
+                continue
+            mask = frame_masks(df, column)
+            shared = np.zeros((len(df), mask_words(len(vocabulary))), dtype=np.uint64)
+            for old, item in enumerate(df.attrs[column + '_vocabulary']):
+                new = positions[item]
+                bit = (mask[:, old // 64] >> np.uint64(old % 64)) & np.uint64(1)
+                shared[:, new // 64] |= bit << np.uint64(new % 64)
+            assign_masks(df, column, shared)
+            df.attrs[column + '_vocabulary'] = vocabulary
+    return frames
+
+def parse_generalized(*frames):
+    # every [a-b] column gets int64 <column>_min, <column>_max and <column>_mid columns,
+    # every set column like "['nsw', 'vic']" gets a bitmask over a vocabulary shared by all frames,
+    # stored in frame.attrs['<column>_vocabulary'], as uint64 words <column>_mask_0, <column>_mask_1, ...
+    columns = [column for column in frames[0].columns
+               if all(column in df.columns and df[column].dtype == object for df in frames)]
+    for column in columns:
+        bounds = [df[column].str.extract(range_pattern) for df in frames]
+        if all(bound.notna().all().all() for bound in bounds):
+            for df, bound in zip(frames, bounds):
+                low = bound[0].astype(np.int64).to_numpy()
+                high = bound[1].astype(np.int64).to_numpy()
+                df[column + '_min'] = low
+                df[column + '_max'] = high
+                df[column + '_mid'] = ((low + high) / 2).astype(np.int64)
+            continue
+
+        if not any(df[column].str.startswith('[').any() for df in frames):
+            continue
+        items = [split_set_column(df[column]) for df in frames]
+        vocabulary = sorted(set().union(*(item.unique() for item in items)))
+        for df, item in zip(frames, items):
+            codes = pd.Categorical(item, categories=vocabulary).codes
+            assign_masks(df, column, set_masks(item.index.to_numpy(), codes, len(df), mask_words(len(vocabulary))))
+            df.attrs[column + '_vocabulary'] = vocabulary
+    return frames
+
+def split_set_column(series):
+    # items of a set column indexed by row position, a value without brackets is a single item
+    values = series.reset_index(drop=True).fillna('').str.strip()
+    is_list = values.str.startswith('[')
+    items = pd.concat([values[is_list].str.findall(r"'([^']*)'").explode().dropna(), values[~is_list]])
+    return items.str.strip()
+
+def popcount(values):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1).reshape(values.shape)
+
+def mask_words(size):
+    # uint64 words of the bitmask of a vocabulary, item i is bit i % 64 of word i // 64
+    return max(1, -(-size // 64))
+
+def mask_columns(column, words):
+    return [f'{column}_mask_{word}' for word in range(words)]
+
+def set_masks(rows, codes, size, words):
+    # bitmask of every row from the (row position, item code) pairs of its items
+    codes = np.asarray(codes, dtype=np.int64)
+    mask = np.zeros((size, words), dtype=np.uint64)
+    np.bitwise_or.at(mask, (rows, codes // 64), np.left_shift(np.uint64(1), (codes % 64).astype(np.uint64)))
+    return mask
+
+def assign_masks(df, column, mask):
+    # the words of a bitmask as columns, the words of an earlier mask are replaced,
+    # column by column, a drop would copy the memory-mapped columns of load_bundle
+    for name in frame_mask_columns(df, column):
+        del df[name]
+    for name, word in zip(mask_columns(column, mask.shape[1]), mask.T):
+        df[name] = word
+
+def frame_mask_columns(df, column):
+    pattern = re.compile(re.escape(column) + r'_mask_(\d+)$')
+    words = sorted(int(match.group(1)) for match in map(pattern.match, df.columns) if match)
+    return mask_columns(column, len(words))
+
+def frame_masks(df, column):
+    return np.column_stack([df[name].to_numpy(dtype=np.uint64) for name in frame_mask_columns(df, column)])
+
+def set_jaccard(mask1, mask2):
+    # jaccard similarity of two bitmasks of (rows, words), the narrower one gets empty words,
+    # two empty sets are equal
+    words = max(mask1.shape[1], mask2.shape[1])
+    mask1 = np.pad(mask1, ((0, 0), (0, words - mask1.shape[1])))
+    mask2 = np.pad(mask2, ((0, 0), (0, words - mask2.shape[1])))
+    union = popcount(mask1 | mask2).sum(axis=1)
+    similarity = np.ones(len(mask1), dtype=np.float32)
+    np.divide(popcount(mask1 & mask2).sum(axis=1), union, out=similarity, where=union > 0, casting='unsafe')
+    return similarity
+
 def extract_postcode_range(df):
     df[['postcode_min', 'postcode_max']] = df['postcode'].str.extract(r'\[(\d+)-(\d+)\]').astype(int)
     return df
 
 def create_multi_index(df_a, df_b, pairs):
-    matching_pairs = []
-    for i, j in pairs:
-        a_min, a_max = df_a.loc[i, ['postcode_min', 'postcode_max']]
-        b_min, b_max = df_b.loc[j, ['postcode_min', 'postcode_max']]
-        if a_min < b_max and b_min < a_max:
-            matching_pairs.append((df_a.index[i], df_b.index[j]))
-
-    multi_index = pd.MultiIndex.from_tuples(matching_pairs, names=['index_a', 'index_b'])
+    # keep the pairs whose postcode ranges overlap, the predicate runs on whole columns at once
+    pairs_a = np.asarray(pairs.get_level_values(0))
+    pairs_b = np.asarray(pairs.get_level_values(1))
+    position_a = df_a.index.get_indexer(pairs_a)
+    position_b = df_b.index.get_indexer(pairs_b)
+    a_min = df_a['postcode_min'].to_numpy()[position_a]
+    a_max = df_a['postcode_max'].to_numpy()[position_a]
+    b_min = df_b['postcode_min'].to_numpy()[position_b]
+    b_max = df_b['postcode_max'].to_numpy()[position_b]
+    overlap = (a_min < b_max) & (b_min < a_max)
+
+    multi_index = pd.MultiIndex.from_arrays([df_a.index[pairs_a[overlap]], df_b.index[pairs_b[overlap]]],
+                                            names=['index_a', 'index_b'])
     return multi_index
 
+class IntervalOverlap(BaseIndexAlgorithm):
+    """
+    Blocking on generalized [min-max] ranges, a record pair is a candidate when the ranges overlap
+    on every range column. The first range column is joined with a sort and sweep: two ranges
+    overlap when the start of one lies inside the other, so both directions are range queries on
+    sorted starts, which costs O((n+m) log n + output). The other range columns filter the pairs.
+
+    Example: indexer.add(IntervalOverlap([('postcode_min', 'postcode_max')]))
+    """
+
+    def __init__(self, ranges, closed=True, **kwargs):
+        """
+        :param ranges: list of (min column, max column) pairs, the same names in both datasets
+        :param closed: treat the ranges as closed intervals, a shared end point is an overlap
+        """
+        super().__init__(**kwargs)
+        self.ranges = list(ranges)
+        self.closed = closed
+
+    def _overlap(self, a_min, a_max, b_min, b_max):
+        if self.closed:
+            return (a_min <= b_max) & (b_min <= a_max)
+        return (a_min < b_max) & (b_min < a_max)
+
+    @staticmethod
+    def _expand(owner_starts, starts, stops):
+        """
+        turn one block [start, stop) of sorted positions per owner into flat pair arrays
+        """
+        counts = np.maximum(stops - starts, 0)
+        owner = np.repeat(owner_starts, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return owner, np.repeat(starts, counts) + offsets
+
+    def _link_index(self, df_a, df_b):
+        min_col, max_col = self.ranges[0]
+        a_min = df_a[min_col].to_numpy(dtype=float)
+        a_max = df_a[max_col].to_numpy(dtype=float)
+        b_min = df_b[min_col].to_numpy(dtype=float)
+        b_max = df_b[max_col].to_numpy(dtype=float)
+        valid_a = np.flatnonzero(~(np.isnan(a_min) | np.isnan(a_max)))
+        valid_b = np.flatnonzero(~(np.isnan(b_min) | np.isnan(b_max)))
+        order_a = valid_a[np.argsort(a_min[valid_a], kind='stable')]
+        order_b = valid_b[np.argsort(b_min[valid_b], kind='stable')]
+        sorted_a = a_min[order_a]
+        sorted_b = b_min[order_b]
+        end_side = 'right' if self.closed else 'left'
+
+        # the start of b lies inside a
+        starts = np.searchsorted(sorted_b, a_min[valid_a], side='left')
+        stops = np.searchsorted(sorted_b, a_max[valid_a], side=end_side)
+        pos_a1, sorted_pos = self._expand(valid_a, starts, stops)
+        pos_b1 = order_b[sorted_pos]
+
+        # the start of a lies inside b, after the start of b
+        starts = np.searchsorted(sorted_a, b_min[valid_b], side='right')
+        stops = np.searchsorted(sorted_a, b_max[valid_b], side=end_side)
+        pos_b2, sorted_pos = self._expand(valid_b, starts, stops)
+        pos_a2 = order_a[sorted_pos]
+
+        pos_a = np.concatenate([pos_a1, pos_a2])
+        pos_b = np.concatenate([pos_b1, pos_b2])
+        for min_col, max_col in self.ranges:
+            keep = self._overlap(df_a[min_col].to_numpy(dtype=float)[pos_a], df_a[max_col].to_numpy(dtype=float)[pos_a],
+                                 df_b[min_col].to_numpy(dtype=float)[pos_b], df_b[max_col].to_numpy(dtype=float)[pos_b])
+            pos_a = pos_a[keep]
+            pos_b = pos_b[keep]
+
+        order = np.lexsort((pos_b, pos_a))
+        return pd.MultiIndex.from_arrays([df_a.index[pos_a[order]], df_b.index[pos_b[order]]],
+                                         names=['index_a', 'index_b'])
+
+
+class CompareSetOverlap(BaseCompareFeature):
+    """
+    Jaccard similarity of two set bitmasks from parse_generalized, two empty sets are equal.
+    left_on and right_on are the lists of the mask word columns, see frame_mask_columns.
+    """
+
+    def _compute_vectorized(self, *columns):
+        half = len(columns) // 2
+        mask1 = np.column_stack([column.to_numpy(dtype=np.uint64) for column in columns[:half]])
+        mask2 = np.column_stack([column.to_numpy(dtype=np.uint64) for column in columns[half:]])
+        return set_jaccard(mask1, mask2)
+
 class CompareEuclideanDistance(BaseCompareFeature):
-    def __init__(self, left_on, right_on, *args, **kwargs):
-        super().__init__(left_on, right_on, *args, **kwargs)
+    """
+    Numeric similarity 1 - (|s1 - s2| - offset) / scale.
+    With a fixed offset and scale, e.g. from distance_range over all candidate pairs or the
+    global range of the attribute, the result does not depend on how the pairs are batched.
+    Without a scale the min and max distance of the current call are used.
+    """
+
+    def __init__(self, left_on, right_on, scale=None, offset=0.0, **kwargs):
+        super().__init__(left_on, right_on, **kwargs)
+        self.scale = scale
+        self.offset = offset
 
     def _compute_vectorized(self, s1, s2):
-        print("s1:", s1)
-        print("s2:", s2)
-        distance = np.sqrt((s1 - s2) ** 2)
+        # the difference is taken at the input precision and stored as float32,
+        # dates of birth do not fit into the float32 mantissa
+        distance = np.empty(len(s1), dtype=np.float32)
+        np.subtract(s1.to_numpy(), s2.to_numpy(), out=distance, casting='unsafe')
+        np.abs(distance, out=distance)
 
-        min_dist = np.min(distance)
-        max_dist = np.max(distance)
-        normalized_distance = 1 - (distance - min_dist) / (max_dist - min_dist)
+        offset, scale = self.offset, self.scale
+        if scale is None:
+            offset = distance.min() if len(distance) else 0.0
+            scale = distance.max() - offset if len(distance) else 0.0
+        if scale > 0:
+            distance -= offset
+            distance /= scale
+            np.subtract(1, distance, out=distance)
+        else:
+            # every distance is the same, the pairs are equally similar
+            distance.fill(1)
 
-        return normalized_distance
+        return distance
 
-def preprocess_data(df):
-    df['street_number'] = df['street_number'].apply(process_range_string).astype(int)
-    df['postcode'] = df['postcode'].apply(process_range_string).astype(int)
-    df['date_of_birth'] = df['date_of_birth'].apply(process_range_string).astype(int)
-    return df
+def distance_range(multi_index, df_a, df_b, column, batch_size=1000000):
+    # min and max distance of a numeric column over all candidate pairs,
+    # the normalization CompareEuclideanDistance applies without a fixed scale
+    values_a = df_a[column].to_numpy()
+    values_b = df_b[column].to_numpy()
+    min_dist = np.inf
+    max_dist = -np.inf
+    for start in range(0, len(multi_index), batch_size):
+        batch = multi_index[start:start + batch_size]
+        distance = np.abs(values_a[df_a.index.get_indexer(batch.get_level_values(0))]
+                          - values_b[df_b.index.get_indexer(batch.get_level_values(1))])
+        min_dist = min(min_dist, distance.min())
+        max_dist = max(max_dist, distance.max())
+    if min_dist > max_dist:
+        return 0.0, 0.0
+    return float(min_dist), float(max_dist - min_dist)
 
-def process_range_string(range_string):
-    range_values = [int(i) for i in range_string.strip('[]').replace(' ', '').split('-')]
-    return sum(range_values) / len(range_values)
+def preprocess_data(df):
+    return parse_generalized(df)[0]
 
-def compare_records(multi_index, df_a, df_b):
+def build_comparator(scales=None, string_columns=None, masks=None):
+    # scales maps a numeric column to the (offset, scale) of its distance normalization,
+    # string_columns maps a string column to its similarity method, e.g. on the data before the anonymization,
+    # masks are the word columns of the state bitmask, frame_mask_columns of the compared frames
+    scales = scales or {}
     comp = rl.Compare()
-    comp.add(CompareEuclideanDistance('postcode', 'postcode'))
-    comp.add(CompareEuclideanDistance('street_number', 'street_number'))
-    comp.add(CompareEuclideanDistance('date_of_birth', 'date_of_birth'))
-    comp.string('state','state',method ='jaro')
+    for column in numeric_columns:
+        offset, scale = scales.get(column, (0.0, None))
+        comp.add(CompareEuclideanDistance(column, column, scale=scale, offset=offset))
+    masks = masks or mask_columns('state', 1)
+    comp.add(CompareSetOverlap(masks, masks))
     comp.exact('salary-class','salary-class')
-    comp.compute(multi_index, df_a, df_b)
-    return comp.compute(multi_index, df_a, df_b)
+    for column, method in (string_columns or {}).items():
+        comp.add(CompareCachedString(column, column, method=method, label=column))
+    return comp
+
+@instrumentation.timed("index.compare")
+def compare_records(multi_index, df_a, df_b, batch_size=None, workers=None, scales=None, string_columns=None):
+    instrumentation.count_rows(len(multi_index))
+    # the numeric distances are normalized over all pairs once, so every batch scores alike
+    if scales is None:
+        scales = {column: distance_range(multi_index, df_a, df_b, column) for column in numeric_columns}
+    # without a batch size all pairs are compared at once
+    if batch_size is None:
+        return build_comparator(scales, string_columns, frame_mask_columns(df_a, 'state')).compute(
+            multi_index, df_a, df_b)
+    return compare_in_batches(multi_index, df_a, df_b, batch_size, workers, scales, string_columns)
 
+def compare_in_batches(multi_index, df_a, df_b, batch_size, workers=None, scales=None, string_columns=None):
+    # compare the pairs in fixed-size batches and write the features into one float32 matrix,
+    # so the memory of the comparison grows with the batch size instead of the number of pairs,
+    # one comparator per process serves all its batches, so the string caches carry over
+    bounds = [(start, min(start + batch_size, len(multi_index))) for start in range(0, len(multi_index), batch_size)]
+    masks = frame_mask_columns(df_a, 'state')
+    features = None
+
+    def store(start, stop, values):
+        nonlocal features
+        if features is None:
+            features = np.empty((len(multi_index), values.shape[1]), dtype=np.float32)
+        features[start:stop] = values
+
+    if workers:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_compare_worker,
+                                 initargs=(df_a, df_b, scales, string_columns)) as executor:
+            futures = [(start, stop, executor.submit(compare_batch, multi_index[start:stop]))
+                       for start, stop in bounds]
+            for start, stop, future in futures:
+                store(start, stop, future.result())
+    else:
+        comp = build_comparator(scales, string_columns, masks)
+        for start, stop in bounds:
+            store(start, stop, comp.compute(multi_index[start:stop], df_a, df_b).to_numpy(dtype=np.float32))
+
+    if features is None:
+        return build_comparator(scales, string_columns, masks).compute(multi_index, df_a, df_b).astype(np.float32)
+    return pd.DataFrame(features, index=multi_index)
+
+def init_compare_worker(df_a, df_b, scales=None, string_columns=None):
+    global _COMPARE_DATA
+    _COMPARE_DATA = (build_comparator(scales, string_columns, frame_mask_columns(df_a, 'state')), df_a, df_b)
+
+def compare_batch(batch):
+    comp, df_a, df_b = _COMPARE_DATA
+    return comp.compute(batch, df_a, df_b).to_numpy(dtype=np.float32)
+
+@instrumentation.timed("index.categorize")
 def categorize_matches(comparison_result, threshold_match):
+    instrumentation.count_rows(len(comparison_result))
     total_similarity = comparison_result.sum(axis=1)
+    threshold_match, possible_min, possible_max = threshold_bounds(threshold_match, total_similarity.dtype)
     matches_index = total_similarity[total_similarity >= threshold_match].index
-    possible_matches_index = total_similarity[total_similarity.between(threshold_match - 1, threshold_match - 0.1)].index
-    non_matches_index = total_similarity[total_similarity < threshold_match - 1].index
+    possible_matches_index = total_similarity[total_similarity.between(possible_min, possible_max)].index
+    non_matches_index = total_similarity[total_similarity < possible_min].index
     return matches_index, possible_matches_index, non_matches_index
 
 
-def visualize_threshold_effect(total_similarity, threshold_range):
-    match_counts = []
-    possible_match_counts = []
-    not_match_counts = []
+def threshold_bounds(thresholds, dtype):
+    # the match threshold and the bounds of the possible matches in the dtype of the scores, a float32
+    # score equal to a bound is compared with the float32 bound whatever the type of the threshold
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    dtype = dtype if np.dtype(dtype).kind == 'f' else np.float64
+    return tuple(bound.astype(dtype) for bound in [thresholds, thresholds - 1, thresholds - 0.1])
 
-    for threshold in threshold_range:
-        matches_index = total_similarity[total_similarity >= threshold].index
-        possible_matches_index = total_similarity[total_similarity.between(threshold - 1, threshold - 0.1)].index
-        non_matches_index = total_similarity[total_similarity < threshold - 1].index
 
-        match_counts.append(len(matches_index))
-        possible_match_counts.append(len(possible_matches_index))
-        not_match_counts.append(len(non_matches_index))
+class ThresholdSweep(object):
+    """
+    Counts of the categories of categorize_matches for many thresholds at once.
+    The similarity scores are sorted once, then every threshold is three binary searches, so a sweep
+    over T thresholds costs O(n log n + T log n) instead of three full scans per threshold.
+    """
 
-    plt.figure(figsize=(10, 6))
-    plt.plot(threshold_range, match_counts, label='Match')
-    plt.plot(threshold_range, possible_match_counts, label='Possible Match')
-    plt.plot(threshold_range, not_match_counts, label='Not Match')
-    plt.xlabel('Threshold')
-    plt.ylabel('Count')
-    plt.title('Number of Matches, Possible Matches, and Not Matches vs. Threshold')
-    plt.legend()
-    plt.grid(True)
-    plt.show()
+    def __init__(self, total_similarity):
+        """
+        :param total_similarity: summed similarity of every pair, e.g. comparison_result.sum(axis=1)
+        """
+        self.scores = np.sort(np.asarray(total_similarity))
+        if self.scores.dtype.kind != 'f':
+            self.scores = self.scores.astype(np.float64)
 
+    def counts(self, thresholds):
+        """
+        :return: DataFrame indexed by threshold with the match, possible_match and not_match counts
+        """
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        # the bounds compare in the dtype of the scores like in categorize_matches
+        match_min, possible_min, possible_max = threshold_bounds(thresholds, self.scores.dtype)
+        match_start = np.searchsorted(self.scores, match_min, side='left')
+        possible_start = np.searchsorted(self.scores, possible_min, side='left')
+        possible_stop = np.searchsorted(self.scores, possible_max, side='right')
+        return pd.DataFrame({
+            'match': len(self.scores) - match_start,
+            'possible_match': np.maximum(possible_stop - possible_start, 0),
+            'not_match': possible_start,
+        }, index=pd.Index(thresholds, name='threshold'))
 
-def main():
-    # Load data
-    df_a, df_b = load_data('/Users/lixiaoying/Desktop/Masterarbeit/Master/k-anonymization/output/output_dataset_a.csv',
-                           '/Users/lixiaoying/Desktop/Masterarbeit/Master/k-anonymization/output/output_dataset_b.csv')
+def plot_threshold_counts(counts, output_file=None):
+    # with an output file the figure is rendered without a display, otherwise it is shown
+    if output_file is None:
+        figure = plt.figure(figsize=(10, 6))
+    else:
+        figure = Figure(figsize=(10, 6))
+    ax = figure.add_subplot()
+    ax.plot(counts.index, counts['match'], label='Match')
+    ax.plot(counts.index, counts['possible_match'], label='Possible Match')
+    ax.plot(counts.index, counts['not_match'], label='Not Match')
+    ax.set_xlabel('Threshold')
+    ax.set_ylabel('Count')
+    ax.set_title('Number of Matches, Possible Matches, and Not Matches vs. Threshold')
+    ax.legend()
+    ax.grid(True)
+    if output_file is None:
+        plt.show()
+    else:
+        figure.savefig(output_file)
+
+def visualize_threshold_effect(total_similarity, threshold_range, output_file=None):
+    counts = ThresholdSweep(total_similarity).counts(threshold_range)
+    plot_threshold_counts(counts, output_file)
+    return counts
 
-    # Extract postcode range
-    df_a = extract_postcode_range(df_a)
-    df_b = extract_postcode_range(df_b)
 
-    # Define indexer and perform blocking
+@instrumentation.timed("index.block")
+def block_records(df_a, df_b, blocking='block'):
+    # blocking on the postcode range bounds, then keep the overlapping ranges,
+    # the rows of the stage are the candidate pairs.
+    # 'interval' blocking keeps every pair of overlapping postcode ranges, also when no bound is shared
+    if blocking == 'interval':
+        # recordlinkage names the levels after the frame indexes, which are unnamed
+        multi_index = IntervalOverlap([('postcode_min', 'postcode_max')], closed=False).index(df_a, df_b)
+        multi_index = multi_index.set_names(['index_a', 'index_b'])
+        instrumentation.count_rows(len(multi_index))
+        return multi_index
+    if blocking != 'block':
+        raise ValueError(f"unknown blocking {blocking}, one of {blocking_methods}")
     indexer = rl.Index()
     indexer.add(Block('postcode_min'))
     indexer.add(Block('postcode_max'))
     pairs = indexer.index(df_a, df_b)
-
-    # Create MultiIndex and save as CSV
     multi_index = create_multi_index(df_a, df_b, pairs)
+    instrumentation.count_rows(len(multi_index))
+    return multi_index
+
+def link_records(file_a, file_b, threshold_match, output_folder=None, blocking='block'):
+    # blocking, comparison and categorization of two anonymized datasets,
+    # with an output folder the results are written like index_output
+    df_a, df_b = load_anonymized(file_a, file_b)
+    multi_index = block_records(df_a, df_b, blocking)
+    comparison_result = compare_records(multi_index, df_a, df_b)
+    comparison_result.columns = variable_names
+
+    result = {'comparison_result': comparison_result}
+    categories = categorize_matches(comparison_result, threshold_match)
+    for name, index in zip(['match', 'possible_match', 'not_match'], categories):
+        result[name] = pd.DataFrame({
+            'index_a': df_a.iloc[index.get_level_values('index_a').values, 0].values,
+            'index_b': df_b.iloc[index.get_level_values('index_b').values, 0].values,
+        })
+
+    if output_folder is not None:
+        with instrumentation.stage("index.write", len(comparison_result)):
+            os.makedirs(output_folder, exist_ok=True)
+            comparison_result.to_csv(os.path.join(output_folder, 'comparison_result.csv'))
+            for name in ['match', 'possible_match', 'not_match']:
+                result[name].to_csv(os.path.join(output_folder, name + '.csv'), index=False)
+    return result
+
+def main():
+    # Load data and parse the generalized columns
+    df_a, df_b = load_anonymized('/Users/lixiaoying/Desktop/Masterarbeit/Master/k-anonymization/output/output_dataset_a.csv',
+                           '/Users/lixiaoying/Desktop/Masterarbeit/Master/k-anonymization/output/output_dataset_b.csv')
+
+    # Perform blocking and create MultiIndex
+    multi_index = block_records(df_a, df_b)
     multi_index_df = multi_index.to_frame(index=False)
     multi_index_df.columns = ['index_a', 'index_b']
     #multi_index_df['index_a'] = df_a.iloc[multi_index_df['index_a']]['index'].values
     #multi_index_df['index_b'] = df_b.iloc[multi_index_df['index_b']]['index'].values
     #multi_index_df.to_csv(r'index_output/multi_index.csv', index=False)
-    print(multi_index)
-
-    # Preprocess data
-    df_a = preprocess_data(df_a)
-    df_b = preprocess_data(df_b)
 
     # Calculate total comparison pairs
     total_comparison_pairs = len(df_a) * len(df_b)
@@ -135,7 +539,6 @@ def main():
     print("Blocking Efficiency: {:.2%}".format(blocking_efficiency))
 
     # Compare records and save as CSV
-    variable_names = ['postcode', 'street_number', 'date_of_birth', 'state', 'salary-class']
     comparison_result = compare_records(multi_index, df_a, df_b)
     comparison_result.columns = variable_names
     #comparison_result_df = comparison_result.reset_index()
@@ -150,26 +553,23 @@ def main():
     matches_index, possible_matches_index, non_matches_index = categorize_matches(comparison_result, threshold_match)
 
     # Output match categories
-    print("match:")
     #print(matches_index)
     match = list(zip(df_a.iloc[matches_index.get_level_values('index_a').values, 0].values, df_b.iloc[matches_index.get_level_values('index_b').values, 0].values))
     #match_df = pd.DataFrame(match, columns = ['index_a', 'index_b'])
    # match_df.to_csv(r'index_output/match.csv', index=False)
-    print(match)
-    print("\npossible match:")
+    print("match:", len(match))
     #print(possible_matches_index)
     possible_match = list(zip(df_a.iloc[possible_matches_index.get_level_values('index_a').values, 0].values,
                    df_b.iloc[possible_matches_index.get_level_values('index_b').values, 0].values))
     #possible_match_df = pd.DataFrame(possible_match, columns = ['index_a','index_b'])
     #possible_match_df.to_csv(r'index_output/possible_match.csv', index = False)
-    print(possible_match)
-    print("\nnot match:")
+    print("possible match:", len(possible_match))
     #print(non_matches_index)
     not_match = list(zip(df_a.iloc[non_matches_index.get_level_values('index_a').values, 0].values,
                    df_b.iloc[non_matches_index.get_level_values('index_b').values, 0].values))
     #not_match_df = pd.DataFrame(not_match, columns = ['index_a','index_b'])
     #not_match_df.to_csv(r'index_output/not_match.csv', index = False)
-    print(not_match)
+    print("not match:", len(not_match))
 
     # Visualize threshold effect
     threshold_range = np.linspace(1, 5, num=100)
@@ -177,3 +577,4 @@ def main():
 
 if __name__ == "__main__":
     main()
+    instrumentation.finish()
@@ -0,0 +1,143 @@
+import argparse
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.linear_model import LogisticRegression
+
+from Index import categorize_matches
+
+default_batch_size = 1000000
+classifier_models = ['logistic', 'gradient_boosting']
+
+
+class MatchClassifier(object):
+    """
+    Supervised step of the linkage: a model trained on the confident classes of categorize_matches,
+    the matches labeled 1 and the non matches labeled 0, which labels the possible matches again.
+    The features are the columns of the comparison result, they are scored in batches of a float32
+    matrix so the memory of the scoring does not grow with the number of pairs.
+    """
+
+    def __init__(self, model='logistic', seed=None):
+        """
+        :param model: 'logistic' for a logistic regression, 'gradient_boosting' for histogram gradient boosting
+        :param seed: random state of the model
+        """
+        if model not in classifier_models:
+            raise ValueError(f"unknown model {model}, one of {classifier_models}")
+        self.model_name = model
+        if model == 'logistic':
+            self.model = LogisticRegression(class_weight='balanced', random_state=seed)
+        else:
+            self.model = HistGradientBoostingClassifier(class_weight='balanced', random_state=seed)
+        self.feature_names = None
+
+    def features(self, comparison_result):
+        if self.feature_names is not None and list(comparison_result.columns) != self.feature_names:
+            raise ValueError(f"the model is trained on the features {self.feature_names}, "
+                             f"not {list(comparison_result.columns)}")
+        return comparison_result.to_numpy(dtype=np.float32)
+
+    def fit(self, comparison_result, threshold_match):
+        """
+        train on the matches and non matches of a comparison result
+        """
+        matches_index, _, non_matches_index = categorize_matches(comparison_result, threshold_match)
+        if len(matches_index) == 0 or len(non_matches_index) == 0:
+            raise ValueError(f"threshold {threshold_match} leaves {len(matches_index)} matches and "
+                             f"{len(non_matches_index)} non matches, both classes are needed to train")
+        self.feature_names = list(comparison_result.columns)
+        features = np.concatenate([self.features(comparison_result.loc[matches_index]),
+                                   self.features(comparison_result.loc[non_matches_index])])
+        labels = np.concatenate([np.ones(len(matches_index), dtype=np.int8),
+                                 np.zeros(len(non_matches_index), dtype=np.int8)])
+        self.model.fit(features, labels)
+        return self
+
+    def score(self, comparison_result, batch_size=default_batch_size, rows=None):
+        """
+        match probability of every pair, only one batch of the pairs is converted to features at a time
+        :param rows: positions of the pairs to score, all pairs by default
+        :return: float32 array in the order of the pairs
+        """
+        # the feature names are checked once, also when there is no pair to score
+        self.features(comparison_result.iloc[:0])
+        if rows is None:
+            rows = np.arange(len(comparison_result))
+        probability = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), batch_size):
+            batch = self.features(comparison_result.iloc[rows[start:start + batch_size]])
+            probability[start:start + len(batch)] = self.model.predict_proba(batch)[:, 1]
+        return probability
+
+    def reclassify(self, comparison_result, threshold_match, batch_size=default_batch_size):
+        """
+        label the possible matches of a comparison result with the model
+        :return: DataFrame indexed like the possible matches with their probability and label, 1 is a match
+        """
+        _, possible_matches_index, _ = categorize_matches(comparison_result, threshold_match)
+        # the possible matches are scored in place, not copied out of the comparison result first
+        rows = comparison_result.index.get_indexer(possible_matches_index)
+        probability = self.score(comparison_result, batch_size, rows)
+        return pd.DataFrame({'probability': probability, 'label': (probability >= 0.5).astype(np.int8)},
+                            index=possible_matches_index)
+
+    def save(self, model_file):
+        joblib.dump({'model_name': self.model_name, 'model': self.model, 'feature_names': self.feature_names},
+                    model_file)
+
+    @classmethod
+    def load(cls, model_file):
+        state = joblib.load(model_file)
+        classifier = cls(state['model_name'])
+        classifier.model = state['model']
+        classifier.feature_names = state['feature_names']
+        return classifier
+
+
+def benchmark_scoring(classifier, pairs, batch_size=default_batch_size, seed=0):
+    # scoring throughput on random features in the range of the similarities, pairs per second
+    rng = np.random.default_rng(seed)
+    features = pd.DataFrame(rng.random((pairs, len(classifier.feature_names)), dtype=np.float32),
+                            columns=classifier.feature_names)
+    start = time.perf_counter()
+    classifier.score(features, batch_size)
+    return pairs / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    # PYTHONPATH=.. python classification.py --comparison_result index_output/comparison_result.csv --threshold 4.5
+    #     --model_file model.joblib --output index_output/reclassified.csv
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--comparison_result', required=True, help='input the comparison result csv of the linkage.')
+    parser.add_argument('--threshold', type=float, default=4.5, help='input the match threshold.')
+    parser.add_argument('--model', default='logistic', choices=classifier_models, help='input the model to train.')
+    parser.add_argument('--model_file', default=None,
+                        help='input the model file, an existing file is loaded instead of training a model.')
+    parser.add_argument('--seed', type=int, default=None, help='input the random state of the model.')
+    parser.add_argument('--batch_size', type=int, default=default_batch_size, help='input the scoring batch size.')
+    parser.add_argument('--output', default=None, help='input the csv of the labeled possible matches.')
+    parser.add_argument('--benchmark', type=int, default=0, help='input a number of random pairs to time the scoring.')
+    args = parser.parse_args()
+
+    comparison_result = pd.read_csv(args.comparison_result, index_col=[0, 1])
+    if args.model_file and os.path.exists(args.model_file):
+        classifier = MatchClassifier.load(args.model_file)
+    else:
+        classifier = MatchClassifier(args.model, args.seed).fit(comparison_result, args.threshold)
+        if args.model_file:
+            classifier.save(args.model_file)
+
+    reclassified = classifier.reclassify(comparison_result, args.threshold, args.batch_size)
+    print("possible match:", len(reclassified))
+    print("labeled match:", int(reclassified['label'].sum()))
+    print("labeled not match:", int(len(reclassified) - reclassified['label'].sum()))
+    if args.output:
+        reclassified.to_csv(args.output)
+    if args.benchmark:
+        print("scoring throughput: {:.0f} pairs/s".format(benchmark_scoring(classifier, args.benchmark,
+                                                                            args.batch_size)))
@@ -0,0 +1,351 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from Index import numeric_columns, range_pattern, variable_names, split_set_column, categorize_matches, \
+    block_records, distance_range, parse_generalized, mask_words, mask_columns, set_masks, set_jaccard
+
+# generalized range columns compared on their midpoints, and the set and exact columns
+range_columns = [column[:-len('_mid')] for column in numeric_columns]
+set_columns = ['state']
+exact_columns = ['salary-class']
+# blocking columns, a pair is a candidate when it agrees on any of them, the same as block_records
+blocking_columns = ['postcode_min', 'postcode_max']
+
+
+class LinkageIndex(object):
+    """
+    Persistent linkage index of dataset B for incremental record linkage.
+    Every appended batch of B becomes a segment: the comparison features of its records as typed
+    columns, and per blocking column the sorted distinct values with the row positions of each.
+    A new batch of A is blocked by binary search in the blocks of every segment and compared with the
+    stored records only. On disk a segment is a folder of .npy files written once, index.json is the
+    manifest of the segments, so save only writes the new segments and load memory-maps the files
+    without reading or regrouping the stored records.
+    The work of append and save grows with the batch, the one of link with the batch and the candidate
+    pairs, plus one binary search per segment.
+
+    The numeric similarities need a fixed normalization to not depend on the batch, the scales do not
+    change on append. compare_records normalizes by the min and max distance over the candidate pairs,
+    the index only gives the same similarities, and so the same categories at a threshold, with those
+    scales, see reference_scales. Without given scales the range of the values in the first batch of B
+    is used, which only ranks the pairs of the index consistently.
+    """
+
+    def __init__(self, scales=None):
+        """
+        :param scales: dict of numeric column to the (offset, scale) of CompareEuclideanDistance
+        """
+        self.scales = dict(scales or {})
+        # whether the scales were given, or taken from the first batch of B
+        self.scales_given = bool(self.scales)
+        self.size = 0
+        # dicts of name, start, size, columns and blocks, see make_segment
+        self.segments = []
+        # set items in order of arrival, item i is bit i % 64 of the mask word i // 64
+        self.vocabulary = {column: {} for column in set_columns}
+        # the folder the index was saved to or loaded from, and its segments already written there
+        self.folder = None
+        self.written = set()
+
+    @classmethod
+    def build(cls, df_b, scales=None):
+        """
+        :param df_b: anonymized dataset B, as written by the Mondrian anonymization
+        """
+        index = cls(scales)
+        index.append(df_b)
+        return index
+
+    def features(self, df, extend=True):
+        """
+        comparison features of an anonymized frame
+        :param extend: add new set items to the vocabulary of the index, a linked batch only borrows them
+        """
+        columns = {'index': df.iloc[:, 0].astype(str).to_numpy(dtype=object)}
+        for column in range_columns:
+            bound = df[column].astype(str).str.extract(range_pattern)
+            single = pd.to_numeric(df[column], errors='coerce')
+            low = bound[0].fillna(single).astype(np.int64).to_numpy()
+            high = bound[1].fillna(single).astype(np.int64).to_numpy()
+            columns[column + '_min'] = low
+            columns[column + '_max'] = high
+            columns[column + '_mid'] = ((low + high) / 2).astype(np.int64)
+        for column in set_columns:
+            items = split_set_column(df[column].astype(str))
+            vocabulary = self.vocabulary[column] if extend else dict(self.vocabulary[column])
+            for item in items.unique():
+                vocabulary.setdefault(item, len(vocabulary))
+            mask = set_masks(items.index.to_numpy(), items.map(vocabulary).to_numpy(), len(df),
+                             mask_words(len(vocabulary)))
+            columns.update(zip(mask_columns(column, mask.shape[1]), mask.T))
+        for column in exact_columns:
+            columns[column] = df[column].astype(str).to_numpy(dtype=object)
+        return columns
+
+    def append(self, df_b):
+        """
+        add a batch of B records to the index as a new segment
+        """
+        columns = self.features(df_b)
+        count = len(df_b)
+        if not count:
+            return self
+        if not self.scales:
+            # the global range of every numeric column over the first batch
+            self.scales = {column: (0.0, float(columns[column].max() - columns[column].min()))
+                           for column in numeric_columns}
+        name = 'segment_%06d' % len(self.segments)
+        self.segments.append(make_segment(name, self.size, columns, make_blocks(columns)))
+        self.size += count
+        return self
+
+    def candidate_pairs(self, columns, segment):
+        """
+        pairs of the batch rows and the rows of a segment which agree on a blocking column and have
+        overlapping postcode ranges, like block_records
+        :return: row positions in the batch and in the segment
+        """
+        pairs = [np.empty(0, dtype=np.int64)]
+        for column in blocking_columns:
+            keys, starts, order = segment['blocks'][column]
+            values = columns[column]
+            found = np.minimum(np.searchsorted(keys, values), max(len(keys) - 1, 0))
+            match = (found < len(keys)) & (keys[found] == values) if len(keys) else np.zeros(len(values), bool)
+            rows = np.flatnonzero(match)
+            pos_a, block = expand(rows, starts[found[rows]], starts[found[rows] + 1])
+            # pair code position_a * size + position_b, a pair found by two columns is kept once
+            pairs.append(pos_a * segment['size'] + order[block])
+        pairs = np.unique(np.concatenate(pairs))
+        pos_a = pairs // segment['size']
+        pos_b = pairs % segment['size']
+        stored = segment['columns']
+        overlap = ((columns['postcode_min'][pos_a] < stored['postcode_max'][pos_b])
+                   & (stored['postcode_min'][pos_b] < columns['postcode_max'][pos_a]))
+        return pos_a[overlap], pos_b[overlap]
+
+    def link(self, df_a):
+        """
+        block and compare a batch of A records against the index
+        :return: comparison result like compare_records, indexed by the record ids (index_a, index_b)
+        """
+        columns = self.features(df_a, extend=False)
+        results = [(np.empty((0, len(variable_names)), dtype=np.float32), np.empty(0, dtype=np.int64),
+                    np.empty(0, dtype=np.int64), np.empty(0, dtype=object))]
+        for segment in self.segments:
+            pos_a, pos_b = self.candidate_pairs(columns, segment)
+            index_b = np.asarray(segment['columns']['index'][pos_b]).astype(object)
+            results.append((self.compare(columns, pos_a, segment['columns'], pos_b), pos_a,
+                            segment['start'] + pos_b, index_b))
+        features, pos_a, pos_b, index_b = (np.concatenate(parts) for parts in zip(*results))
+        # the pairs in the order of a single index, by the rows of A and then of B
+        order = np.lexsort((pos_b, pos_a))
+        multi_index = pd.MultiIndex.from_arrays([columns['index'][pos_a[order]], index_b[order]],
+                                                names=['index_a', 'index_b'])
+        return pd.DataFrame(features[order], index=multi_index, columns=variable_names)
+
+    def compare(self, columns, pos_a, stored, pos_b):
+        # the features of compare_records of the pairs of batch and segment rows
+        features = np.empty((len(pos_a), len(variable_names)), dtype=np.float32)
+        for i, column in enumerate(numeric_columns):
+            distance = features[:, i]
+            np.subtract(columns[column][pos_a], stored[column][pos_b], out=distance, casting='unsafe')
+            np.abs(distance, out=distance)
+            offset, scale = self.scales[column]
+            if scale > 0:
+                distance -= offset
+                distance /= scale
+                np.subtract(1, distance, out=distance)
+            else:
+                distance.fill(1)
+        position = len(numeric_columns)
+        for column in set_columns:
+            features[:, position] = set_jaccard(stack_masks(columns, column, pos_a),
+                                                stack_masks(stored, column, pos_b))
+            position += 1
+        for column in exact_columns:
+            features[:, position] = columns[column][pos_a] == np.asarray(stored[column][pos_b]).astype(object)
+            position += 1
+        return features
+
+    def save(self, folder):
+        """
+        write the segments which are not in the folder yet, and index.json, the manifest of the segments
+        """
+        if os.path.abspath(folder) != self.folder:
+            self.folder = os.path.abspath(folder)
+            self.written = set()
+        for segment in self.segments:
+            if segment['name'] not in self.written:
+                write_segment(os.path.join(folder, segment['name']), segment)
+                self.written.add(segment['name'])
+        meta = {
+            'size': self.size,
+            'segments': [{'name': segment['name'], 'size': segment['size']} for segment in self.segments],
+            'scales': self.scales,
+            'scales_given': self.scales_given,
+            'vocabulary': {column: list(items) for column, items in self.vocabulary.items()},
+        }
+        # the manifest is replaced at once, a reader sees the old or the new segments
+        path = os.path.join(folder, 'index.json')
+        with open(path + '.tmp', 'w') as fw:
+            json.dump(meta, fw)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, folder):
+        with open(os.path.join(folder, 'index.json')) as fr:
+            meta = json.load(fr)
+        index = cls({column: tuple(scale) for column, scale in meta['scales'].items()})
+        index.scales_given = meta.get('scales_given', False)
+        for item in meta['segments']:
+            index.segments.append(read_segment(os.path.join(folder, item['name']), item['name'], index.size,
+                                               item['size']))
+            index.size += item['size']
+        index.vocabulary = {column: {item: i for i, item in enumerate(items)}
+                            for column, items in meta['vocabulary'].items()}
+        index.folder = os.path.abspath(folder)
+        index.written = {segment['name'] for segment in index.segments}
+        return index
+
+
+def make_segment(name, start, columns, blocks):
+    return {'name': name, 'start': start, 'size': len(columns['index']), 'columns': columns, 'blocks': blocks}
+
+
+def make_blocks(columns):
+    """
+    blocks of a segment per blocking column: (sorted distinct values, start of the rows of every value
+    in order and one past the end, row positions grouped by value)
+    """
+    blocks = {}
+    for column in blocking_columns:
+        order = np.argsort(columns[column], kind='stable')
+        values = columns[column][order]
+        first = np.flatnonzero(np.r_[True, values[1:] != values[:-1]]) if len(values) else np.empty(0, np.int64)
+        blocks[column] = (values[first], np.r_[first, len(values)], order)
+    return blocks
+
+
+def write_segment(folder, segment):
+    os.makedirs(folder, exist_ok=True)
+    for name, values in segment['columns'].items():
+        values = np.asarray(values)
+        np.save(os.path.join(folder, name + '.npy'), values.astype(str) if values.dtype == object else values)
+    for column, arrays in segment['blocks'].items():
+        for part, values in zip(['keys', 'starts', 'order'], arrays):
+            np.save(os.path.join(folder, column + '_' + part + '.npy'), values)
+
+
+def read_segment(folder, name, start, size):
+    # the columns and blocks of a segment are memory-mapped, nothing is read before a link needs it
+    columns = {}
+    blocks = {column: [None] * 3 for column in blocking_columns}
+    for file in sorted(os.listdir(folder)):
+        values = np.load(os.path.join(folder, file), mmap_mode='r')
+        key = file[:-len('.npy')]
+        part = key.rsplit('_', 1)
+        if part[0] in blocks and part[1] in ['keys', 'starts', 'order']:
+            blocks[part[0]][['keys', 'starts', 'order'].index(part[1])] = values
+        else:
+            columns[key] = values
+    segment = make_segment(name, start, columns, {column: tuple(arrays) for column, arrays in blocks.items()})
+    segment['size'] = size
+    return segment
+
+
+def expand(owners, starts, stops):
+    """
+    pairs of every owner with the positions of its block [start, stop), as two flat arrays
+    """
+    counts = stops - starts
+    owner = np.repeat(owners, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + offsets
+
+
+def stack_masks(columns, column, positions):
+    # the mask words of a set column at the row positions as one (rows, words) array,
+    # the segments of a grown vocabulary have more words than the older ones
+    names = mask_columns(column, sum(1 for name in columns if name.startswith(column + '_mask_')))
+    return np.column_stack([columns[name][positions] for name in names])
+
+
+def reference_scales(df_a, df_b):
+    """
+    scales of compare_records on two anonymized datasets: the min and max distance of every numeric
+    column over their candidate pairs
+    """
+    df_a, df_b = parse_generalized(df_a, df_b)
+    multi_index = block_records(df_a, df_b)
+    return {column: distance_range(multi_index, df_a, df_b, column) for column in numeric_columns}
+
+
+def parse_scales(text):
+    """
+    :param text: column:offset:scale items, for example age_mid:0:60,postcode_mid:0:7000
+    """
+    scales = {}
+    for item in text.split(","):
+        column, offset, scale = item.split(":")
+        scales[column.strip()] = (float(offset), float(scale))
+    missing = set(numeric_columns) - set(scales)
+    if missing:
+        raise ValueError(f"no scales of {sorted(missing)}")
+    return scales
+
+
+if __name__ == "__main__":
+    # PYTHONPATH=.. python linkage_index.py --index index_b --append output_dataset_b.csv
+    #     --reference output_dataset_a.csv,output_dataset_b.csv
+    # PYTHONPATH=.. python linkage_index.py --index index_b --link output_dataset_a.csv --output index_output
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index', required=True, help='input the folder of the linkage index of B.')
+    parser.add_argument('--scales', default=None,
+                        help='input the normalization of the numeric columns of a new index, column:offset:scale '
+                             'items, for example: ' + ",".join(column + ":0:100" for column in numeric_columns) + '.')
+    parser.add_argument('--reference', default=None,
+                        help='input two anonymized datasets A,B, a new index takes the scales compare_records '
+                             'uses on them, so its categories agree with Index.link_records.')
+    parser.add_argument('--append', default=None, help='input the anonymized B records to add to the index.')
+    parser.add_argument('--link', default=None, help='input the anonymized A records to link against the index.')
+    parser.add_argument('--threshold', type=float, default=4.5, help='input the match threshold.')
+    parser.add_argument('--output', default=None, help='input the folder of the linkage results.')
+    args = parser.parse_args()
+
+    exists = os.path.exists(os.path.join(args.index, 'index.json'))
+    if exists and (args.scales or args.reference):
+        parser.error("the scales of an existing index can not change, build a new index")
+    if exists:
+        linkage_index = LinkageIndex.load(args.index)
+    elif args.scales:
+        try:
+            linkage_index = LinkageIndex(parse_scales(args.scales))
+        except ValueError as error:
+            parser.error(str(error))
+    elif args.reference:
+        reference_a, reference_b = args.reference.split(",")
+        linkage_index = LinkageIndex(reference_scales(pd.read_csv(reference_a), pd.read_csv(reference_b)))
+    else:
+        linkage_index = LinkageIndex()
+    if args.append:
+        linkage_index.append(pd.read_csv(args.append))
+        linkage_index.save(args.index)
+        print("records in the index:", linkage_index.size)
+    if args.link:
+        if not linkage_index.scales_given:
+            # the threshold of Index.link_records does not apply to the similarities of other scales
+            parser.error("the index has no given scales, build it with --scales or --reference to categorize")
+        comparison_result = linkage_index.link(pd.read_csv(args.link))
+        categories = categorize_matches(comparison_result, args.threshold)
+        print("compared pairs:", len(comparison_result))
+        for name, index in zip(['match', 'possible_match', 'not_match'], categories):
+            print(name + ":", len(index))
+            if args.output:
+                os.makedirs(args.output, exist_ok=True)
+                index.to_frame(index=False).to_csv(os.path.join(args.output, name + '.csv'), index=False)
+        if args.output:
+            comparison_result.to_csv(os.path.join(args.output, 'comparison_result.csv'))
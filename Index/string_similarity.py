@@ -0,0 +1,316 @@
+import argparse
+import time
+
+import jellyfish
+import numpy as np
+import pandas as pd
+import recordlinkage as rl
+import scipy.sparse as sp
+from recordlinkage.base import BaseCompareFeature
+from recordlinkage.index import Block
+from sklearn.feature_extraction.text import CountVectorizer
+
+default_cache_size = 1000000
+default_value_cache_size = 1000000
+# a pair of value ids is packed into one int64 key, id_a << key_shift | id_b
+key_shift = 32
+# similarities of two strings, the same definitions as recordlinkage's Compare.string
+string_methods = ['jaro', 'jarowinkler', 'levenshtein', 'damerau_levenshtein', 'qgram']
+# phonetic codes, two strings are similar when their codes are equal
+phonetic_methods = ['soundex', 'metaphone', 'nysiis', 'match_rating_codex']
+# string columns of the febrl datasets before the anonymization
+default_string_columns = {'given_name': 'jarowinkler', 'surname': 'jarowinkler', 'address_1': 'qgram',
+                          'suburb': 'qgram'}
+
+
+class PairCache(object):
+    """
+    Bounded LRU cache of the scores of integer pair keys, looked up and filled a batch at a time.
+    The entries are kept sorted by key, a lookup stamps the entries it finds with the number of the
+    batch, and when the cache is full the entries with the oldest stamps are dropped first.
+    """
+
+    def __init__(self, maxsize=default_cache_size):
+        self.maxsize = maxsize
+        self.keys = np.empty(0, dtype=np.int64)
+        self.scores = np.empty(0, dtype=np.float64)
+        self.stamps = np.empty(0, dtype=np.int64)
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, keys):
+        """
+        :param keys: sorted distinct keys
+        :return: mask of the cached keys and their scores, NaN for the others
+        """
+        self.clock += 1
+        scores = np.full(len(keys), np.nan)
+        found = np.zeros(len(keys), dtype=bool)
+        if len(self.keys):
+            position = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            found = self.keys[position] == keys
+            position = position[found]
+            scores[found] = self.scores[position]
+            self.stamps[position] = self.clock
+        hits = int(found.sum())
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found, scores
+
+    def insert(self, keys, scores):
+        keys = np.concatenate([self.keys, keys])
+        scores = np.concatenate([self.scores, scores])
+        stamps = np.concatenate([self.stamps, np.full(len(keys) - len(self.keys), self.clock)])
+        if len(keys) > self.maxsize:
+            keep = np.argpartition(-stamps, self.maxsize - 1)[:self.maxsize]
+            keys, scores, stamps = keys[keep], scores[keep], stamps[keep]
+        order = np.argsort(keys)
+        self.keys, self.scores, self.stamps = keys[order], scores[order], stamps[order]
+
+    def clear(self):
+        self.keys, self.scores, self.stamps = self.keys[:0], self.scores[:0], self.stamps[:0]
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'maxsize': self.maxsize, 'currsize': len(self.keys)}
+
+
+class StringSimilarity(object):
+    """
+    String similarity of record pairs which does the string work once per distinct value or pair.
+    Every distinct value gets an integer id the first time it is seen, together with its q-gram
+    counts as a row of a sparse matrix, its phonetic code or its length. A pair of values is a key
+    id_a << key_shift | id_b whose score is kept in a PairCache, so the strings of a distinct
+    pair are compared once and the scores of all pairs are gathered from the distinct pairs with
+    one fancy index. The caches live on the instance, so they also serve later batches.
+
+    At most value_cache_size values are interned. When the new values of a batch do not fit, the
+    value table is cleared together with every cached pair score, since the pair keys hold value ids,
+    and the values which still do not fit are encoded for the batch only, their pairs are not cached.
+    """
+
+    def __init__(self, method='jarowinkler', cache_size=default_cache_size,
+                 value_cache_size=default_value_cache_size):
+        """
+        :param method: one of string_methods or phonetic_methods
+        :param cache_size: maximum number of cached pair scores
+        :param value_cache_size: maximum number of interned values
+        """
+        if method not in string_methods + phonetic_methods:
+            raise ValueError(f"unknown method {method}, one of {string_methods + phonetic_methods}")
+        self.method = method
+        self.value_cache_size = value_cache_size
+        if method == 'qgram':
+            # the bigrams of recordlinkage's qgram_similarity, with word boundaries
+            self.analyzer = CountVectorizer(analyzer='char_wb', strip_accents='unicode',
+                                            ngram_range=(2, 2)).build_analyzer()
+        # gram -> column of the q-gram matrices, it only grows, the bigrams of a text are few
+        self.grams = {}
+        self.pairs = PairCache(cache_size)
+        self.clear()
+
+    def clear(self):
+        # drop the interned values and, since their keys hold value ids, every cached pair score
+        self.index = pd.Index([], dtype=object)
+        self.table = self.encode([])
+        self.pairs.clear()
+
+    def intern(self, values):
+        """
+        ids of distinct values, new values are encoded and added while the value table has room
+        :return: (ids, table of the encodings of all ids), ids from len(self.index) on are not interned
+        """
+        ids = self.index.get_indexer(values)
+        new = ids < 0
+        if not new.any():
+            return ids, self.table
+        if len(self.index) + new.sum() > self.value_cache_size and len(self.index):
+            self.clear()
+            ids = np.full(len(values), -1)
+            new = np.ones(len(values), dtype=bool)
+        positions = np.flatnonzero(new)
+        room = max(self.value_cache_size - len(self.index), 0)
+        added, extra = positions[:room], positions[room:]
+        ids[added] = np.arange(len(self.index), len(self.index) + len(added))
+        if len(added):
+            self.index = self.index.append(pd.Index(values[added], dtype=object))
+            self.table = self.extend(self.table, self.encode(values[added].tolist()))
+        if not len(extra):
+            return ids, self.table
+        ids[extra] = np.arange(len(self.index), len(self.index) + len(extra))
+        return ids, self.extend(self.table, self.encode(values[extra].tolist()))
+
+    def encode(self, values):
+        # what the values are compared by: their bigram counts, phonetic codes or lengths
+        table = {'values': list(values), 'lengths': np.array([len(value) for value in values], dtype=np.int64)}
+        if self.method in phonetic_methods:
+            encode = getattr(jellyfish, self.method)
+            table['codes'] = np.array([encode(value) for value in values], dtype=object)
+        elif self.method == 'qgram':
+            indptr = [0]
+            indices = []
+            for value in values:
+                indices.extend(self.grams.setdefault(gram, len(self.grams)) for gram in self.analyzer(value))
+                indptr.append(len(indices))
+            matrix = sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(values), len(self.grams)))
+            matrix.sum_duplicates()
+            table['matrix'] = matrix
+            table['totals'] = np.asarray(matrix.sum(axis=1)).ravel()
+        return table
+
+    def extend(self, table, added):
+        # the encodings of table followed by the ones of added
+        result = {'values': table['values'] + added['values']}
+        for name in ['lengths', 'codes', 'totals']:
+            if name in table:
+                result[name] = np.concatenate([table[name], added[name]])
+        if 'matrix' in table:
+            for matrix in [table['matrix'], added['matrix']]:
+                matrix.resize((matrix.shape[0], len(self.grams)))
+            result['matrix'] = sp.vstack([table['matrix'], added['matrix']], format='csr')
+        return result
+
+    def score(self, table, ids_a, ids_b):
+        """
+        similarity of the pairs of value ids, NaN where it is undefined
+        """
+        if self.method == 'qgram':
+            # the shared bigram counts over the larger bigram count of the two values
+            matrix, totals = table['matrix'], table['totals']
+            shared = np.asarray(matrix[ids_a].minimum(matrix[ids_b]).sum(axis=1)).ravel()
+            total = np.maximum(totals[ids_a], totals[ids_b])
+            return np.divide(shared, total, out=np.full(len(total), np.nan), where=total > 0)
+        values = table['values']
+        pairs = zip(ids_a.tolist(), ids_b.tolist())
+        if self.method in ['jaro', 'jarowinkler']:
+            function = jellyfish.jaro_similarity if self.method == 'jaro' else jellyfish.jaro_winkler_similarity
+            return np.fromiter((function(values[a], values[b]) for a, b in pairs), dtype=np.float64,
+                               count=len(ids_a))
+        function = jellyfish.levenshtein_distance if self.method == 'levenshtein' \
+            else jellyfish.damerau_levenshtein_distance
+        distance = np.fromiter((function(values[a], values[b]) for a, b in pairs), dtype=np.float64,
+                               count=len(ids_a))
+        length = np.maximum(table['lengths'][ids_a], table['lengths'][ids_b])
+        return np.subtract(1, distance / np.where(length > 0, length, 1), out=np.full(len(length), np.nan),
+                           where=length > 0)
+
+    def compare(self, s1, s2):
+        """
+        similarity of the pairs (s1[i], s2[i])
+        :return: float64 array, NaN where a value is missing or the similarity is undefined
+        """
+        if self.method == 'qgram':
+            # recordlinkage compares a missing value as an empty string
+            s1, s2 = s1.fillna(''), s2.fillna('')
+        codes, values = pd.factorize(pd.concat([pd.Series(s1), pd.Series(s2)], ignore_index=True))
+        codes_a, codes_b = codes[:len(s1)], codes[len(s1):]
+        result = np.full(len(s1), np.nan)
+        valid = (codes_a >= 0) & (codes_b >= 0)
+        if not valid.any():
+            return result
+        ids, table = self.intern(values)
+        ids_a, ids_b = ids[codes_a[valid]], ids[codes_b[valid]]
+
+        if self.method in phonetic_methods:
+            result[valid] = table['codes'][ids_a] == table['codes'][ids_b]
+            return result
+
+        # every distinct pair is scored once, unless it is cached, then the scores are gathered for all pairs
+        keys = (ids_a.astype(np.int64) << key_shift) | ids_b
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        unique_a, unique_b = unique_keys >> key_shift, unique_keys & ((1 << key_shift) - 1)
+        # only the pairs of two interned values are cached
+        interned = (unique_a < len(self.index)) & (unique_b < len(self.index))
+        found, cached_scores = self.pairs.lookup(unique_keys[interned])
+        scores = np.full(len(unique_keys), np.nan)
+        scores[interned] = cached_scores
+        todo = ~interned
+        todo[np.flatnonzero(interned)[~found]] = True
+        if todo.any():
+            scores[todo] = self.score(table, unique_a[todo], unique_b[todo])
+            insert = todo & interned
+            self.pairs.insert(unique_keys[insert], scores[insert])
+        result[valid] = scores[inverse]
+        return result
+
+    def cache_info(self):
+        return {'values': len(self.index), 'pairs': self.pairs.info()}
+
+
+class CompareCachedString(BaseCompareFeature):
+    """
+    Drop-in for recordlinkage's Compare.string on top of StringSimilarity, the feature keeps its
+    caches between the batches of compare_in_batches.
+    """
+
+    def __init__(self, left_on, right_on, method='jarowinkler', threshold=None, missing_value=0.0,
+                 cache_size=default_cache_size, value_cache_size=default_value_cache_size, label=None):
+        super().__init__(left_on, right_on, label=label)
+        self.engine = StringSimilarity(method, cache_size, value_cache_size)
+        self.threshold = threshold
+        self.missing_value = missing_value
+
+    def _compute_vectorized(self, s1, s2):
+        similarity = self.engine.compare(s1, s2)
+        missing = np.isnan(similarity)
+        if self.threshold is not None:
+            similarity = (similarity >= self.threshold).astype(np.float64)
+        similarity[missing] = self.missing_value
+        return similarity
+
+
+def parse_string_columns(text):
+    """
+    :param text: column:method pairs, for example given_name:jarowinkler,suburb:qgram
+    """
+    columns = {}
+    for item in text.split(","):
+        column, method = item.split(":")
+        columns[column.strip()] = method.strip()
+    return columns
+
+
+def compare_strings(multi_index, df_a, df_b, string_columns, cached=True):
+    # string features of the candidate pairs, cached or with recordlinkage's Compare.string
+    comp = rl.Compare()
+    for column, method in string_columns.items():
+        if cached:
+            comp.add(CompareCachedString(column, column, method=method, label=column))
+        else:
+            comp.string(column, column, method=method, label=column)
+    return comp.compute(multi_index, df_a, df_b)
+
+
+if __name__ == "__main__":
+    # python string_similarity.py --file_a ../datasets/datasetsA/dataset_a.csv
+    #     --file_b ../datasets/datasetsB/dataset_b.csv --block postcode --reference
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--file_a', required=True, help='input the dataset A before the anonymization.')
+    parser.add_argument('--file_b', required=True, help='input the dataset B before the anonymization.')
+    parser.add_argument('--block', default='postcode', help='input the blocking column of the candidate pairs.')
+    parser.add_argument('--columns', default=None,
+                        help='input the compared columns, column:method pairs, for example: '
+                             'given_name:jarowinkler,surname:jarowinkler,address_1:qgram,suburb:qgram.')
+    parser.add_argument('--reference', action='store_true',
+                        help='also compare with recordlinkage and report both times and the largest difference.')
+    parser.add_argument('--output', default=None, help='input the csv of the string features.')
+    args = parser.parse_args()
+
+    string_columns = parse_string_columns(args.columns) if args.columns else default_string_columns
+    df_a = pd.read_csv(args.file_a)
+    df_b = pd.read_csv(args.file_b)
+    indexer = rl.Index()
+    indexer.add(Block(args.block))
+    multi_index = indexer.index(df_a, df_b)
+    print("compared pairs:", len(multi_index))
+
+    start = time.perf_counter()
+    features = compare_strings(multi_index, df_a, df_b, string_columns)
+    print("cached comparison: {:.3f}s".format(time.perf_counter() - start))
+    if args.reference:
+        start = time.perf_counter()
+        reference = compare_strings(multi_index, df_a, df_b, string_columns, cached=False)
+        print("recordlinkage comparison: {:.3f}s".format(time.perf_counter() - start))
+        print("largest difference:", float((features - reference).abs().max().max()))
+    if args.output:
+        features.to_csv(args.output)
@@ -0,0 +1,212 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+root = os.path.dirname(os.path.abspath(__file__))
+for folder in ["data_processing", "k-anonymization", "Index"]:
+    sys.path.insert(0, os.path.join(root, folder))
+
+import data_cleaning
+import instrumentation
+import Index
+import Mondran
+
+default_pool_file = os.path.join(root, "datasets", "combined_data.csv")
+default_adult_file = os.path.join(root, "datasets", "adult.csv")
+default_output_file = "benchmark_results.json"
+default_sizes = [10000]
+default_engines = ["python", "numpy"]
+# the python engine is quadratic in the size of a partition, larger datasets skip it
+default_python_engine_limit = 100000
+default_chunk_size = 1000000
+# columns of the FEBRL files, with the space after the comma of the header
+febrl_columns = ['rec_id', ' given_name', ' surname', ' street_number', ' address_1', ' address_2', ' suburb',
+                 ' postcode', ' state', ' date_of_birth', ' soc_sec_id']
+# columns which get noise on a duplicate and blank values, the same columns as the noise of the datasets
+text_columns = [' given_name', ' surname', ' address_1', ' address_2', ' suburb', ' state']
+noise_columns = ['given_name', 'surname', 'address_1', 'address_2', 'suburb', 'state']
+
+
+def generate_febrl(size, output_file, duplicate_rate=0.2, noise_rate=0.2, missing_rate=0.02, seed=None,
+                   pool_file=default_pool_file, chunk_size=default_chunk_size):
+    """
+    write a synthetic FEBRL-style dataset like combined_data.csv.
+    Every value is drawn from the values of the same column of the pool file, so the distributions
+    follow the real data. A duplicate is a copy of an original record with the same soc_sec_id whose
+    text columns get the noise of add_noise_to_data, and some text values are left blank.
+    The file is written in chunks, duplicates refer to originals of the same chunk.
+    :param size: number of records including the duplicates
+    :param duplicate_rate: fraction of the records which are duplicates
+    :param noise_rate: fraction of the duplicates which get an edit, per text column
+    :param missing_rate: fraction of the text values which are blank
+    """
+    rng = np.random.default_rng(seed)
+    pool = pd.read_csv(pool_file, dtype=str, keep_default_na=False)
+    pool = {column: pool[column].to_numpy() for column in febrl_columns[1:-1]}
+    pool = {column: values[values != ''] if column in text_columns else values for column, values in pool.items()}
+
+    next_id = 0
+    with open(output_file, "w", newline="") as fout:
+        for start in range(0, size, chunk_size):
+            count = min(chunk_size, size - start)
+            duplicates = int(round(count * duplicate_rate))
+            originals = count - duplicates
+
+            data = pd.DataFrame({column: values[rng.integers(0, len(values), size=originals)]
+                                 for column, values in pool.items()})
+            data.insert(0, 'rec_id', ['rec-%d-org' % i for i in range(next_id, next_id + originals)])
+            data[' soc_sec_id'] = (1000000 + np.arange(next_id, next_id + originals)).astype(str)
+
+            if duplicates:
+                source = rng.integers(0, originals, size=duplicates)
+                copies = data.iloc[source].reset_index(drop=True)
+                copies['rec_id'] = ['rec-%d-dup-%d' % (next_id + i, j) for j, i in enumerate(source)]
+                copies.columns = [column.strip() for column in copies.columns]
+                copies = data_cleaning.add_noise(copies, noise_columns, rng, noise_rate)
+                copies.columns = febrl_columns
+                data = pd.concat([data, copies], ignore_index=True)
+
+            for column in text_columns:
+                blank = rng.random(len(data)) < missing_rate
+                data.loc[blank, column] = ''
+
+            data = data.iloc[rng.permutation(len(data))]
+            data.to_csv(fout, index=False, header=start == 0)
+            next_id += originals
+    return output_file
+
+
+def measure(results, size, stage, function, *args, **kwargs):
+    """
+    time one stage as an instrumentation stage, with its peak traced memory when tracemalloc runs
+    and the peak rss of the process so far
+    """
+    gc.collect()
+    with instrumentation.stage(stage) as record:
+        value = function(*args, **kwargs)
+    results.append({
+        'size': size,
+        'stage': stage,
+        'seconds': record['seconds'],
+        'peak_traced_bytes': record['peak_traced_bytes'],
+        'max_rss_bytes': record['max_rss_bytes'],
+    })
+    print(f"size {size} {stage}: {record['seconds']:.3f}s")
+    return value
+
+
+def add_noise_to_datasets(files, rate, seed):
+    for number, file in enumerate(files):
+        data_cleaning.add_noise_to_data(file, noise_columns, rate, None if seed is None else [seed, number])
+
+
+def anonymize_datasets(files, output_files, attribute_index, k, engine):
+    for input_file, output_file in zip(files, output_files):
+        Mondran.Process(input_file=input_file, output_file=output_file, attribute_index=attribute_index, k=k,
+                        engine=engine).main()
+
+
+def run_benchmark(size, work_dir, results, **kwargs):
+    """
+    run every stage of the linkage on a synthetic dataset of the given size
+    """
+    if kwargs.get("trace_memory", True):
+        instrumentation.configure(profile=["tracemalloc"])
+    seed = kwargs.get("seed", 0)
+    attribute_index = kwargs.get("attribute_index") or Mondran.default_quality_index
+    k = kwargs.get("k", Mondran.default_k)
+    engines = kwargs.get("engines") or default_engines
+    python_engine_limit = kwargs.get("python_engine_limit", default_python_engine_limit)
+    files = {name: os.path.join(work_dir, "%s_%d.csv" % (name, size))
+             for name in ["combined", "cleaned", "merged", "processed", "dataset_a", "dataset_b"]}
+
+    def run(stage, function, *args):
+        return measure(results, size, stage, function, *args)
+
+    run("generate", generate_febrl, size, files["combined"], kwargs.get("duplicate_rate", 0.2),
+        kwargs.get("noise_rate", 0.2), kwargs.get("missing_rate", 0.02), seed)
+    run("clean_data", data_cleaning.clean_data, files["combined"], files["cleaned"])
+    run("merge_data", data_cleaning.merge_data, files["cleaned"], kwargs.get("adult_file") or default_adult_file,
+        files["merged"], seed)
+    run("process_merged_data", data_cleaning.process_merged_data, files["merged"], files["processed"])
+    run("split_and_remove_duplicates", data_cleaning.split_and_remove_duplicates, files["processed"],
+        files["dataset_a"], files["dataset_b"])
+    datasets = [files["dataset_a"], files["dataset_b"]]
+    run("add_noise_to_data", add_noise_to_datasets, datasets, kwargs.get("noise_rate", 0.2), seed)
+
+    anonymized = None
+    for engine in engines:
+        if engine == "python" and size > python_engine_limit:
+            results.append({'size': size, 'stage': 'mondrian_python', 'skipped': True})
+            continue
+        output_files = [os.path.join(work_dir, "output_%s_%s_%d.csv" % (name, engine, size)) for name in "ab"]
+        run("mondrian_" + engine, anonymize_datasets, datasets, output_files, attribute_index, k, engine)
+        anonymized = output_files
+
+    if anonymized is None or not all(os.path.exists(file) for file in anonymized):
+        return
+    df_a, df_b = Index.load_anonymized(*anonymized)
+    multi_index = run("block_records", Index.block_records, df_a, df_b)
+    run("compare_records", Index.compare_records, multi_index, df_a, df_b)
+    results[-1]['pairs'] = len(multi_index)
+
+
+if __name__ == '__main__':
+    # python benchmark.py --sizes 10000,100000 --output benchmark_results.json
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default=",".join(map(str, default_sizes)),
+                        help='input the numbers of synthetic records, for example: 10000,100000,1000000.')
+    parser.add_argument('--duplicate_rate', type=float, default=0.2, help='input the fraction of duplicate records.')
+    parser.add_argument('--noise_rate', type=float, default=0.2, help='input the rate of noisy rows per column.')
+    parser.add_argument('--missing_rate', type=float, default=0.02, help='input the fraction of blank text values.')
+    parser.add_argument('--seed', type=int, default=0, help='input the seed of the synthetic data.')
+    parser.add_argument('--k', type=int, default=Mondran.default_k, help='input the K')
+    parser.add_argument('--quality_index', default=",".join(map(str, Mondran.default_quality_index)),
+                        help='input the quality_index, for example: 3,7,8,9.')
+    parser.add_argument('--engines', default=",".join(default_engines), help='input the Mondrian engines to time.')
+    parser.add_argument('--python_engine_limit', type=int, default=default_python_engine_limit,
+                        help='input the largest size which runs the python engine.')
+    parser.add_argument('--no_memory', action='store_true',
+                        help='do not trace the memory, tracing slows down the stages.')
+    parser.add_argument('--work_dir', default=None, help='input the folder of the data, default a temp folder.')
+    parser.add_argument('--output', default=default_output_file, help='input the json file of the results.')
+    parser.add_argument('--report', default=None,
+                        help='input the json file of the nested stage timings, default the LINKAGE_REPORT variable.')
+    parser.add_argument('--profile', default=None,
+                        help='input the profilers to run, cprofile and/or tracemalloc, for example: '
+                             'cprofile,tracemalloc. Default the LINKAGE_PROFILE variable.')
+    args = parser.parse_args()
+    try:
+        instrumentation.configure(args.report, instrumentation.parse_profile(args.profile))
+    except ValueError as error:
+        parser.error(str(error))
+
+    config = {
+        'sizes': [int(item) for item in args.sizes.split(",")],
+        'duplicate_rate': args.duplicate_rate,
+        'noise_rate': args.noise_rate,
+        'missing_rate': args.missing_rate,
+        'seed': args.seed,
+        'k': args.k,
+        'attribute_index': [int(item.strip()) for item in args.quality_index.split(",")],
+        'engines': [item.strip() for item in args.engines.split(",")],
+        'python_engine_limit': args.python_engine_limit,
+        'trace_memory': not args.no_memory,
+    }
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        for size in config['sizes']:
+            run_benchmark(size, work_dir, results, **config)
+
+    with open(args.output, "w") as fw:
+        json.dump({'created': time.strftime("%Y-%m-%dT%H:%M:%S"), 'config': config,
+                   'environment': instrumentation.environment(), 'results': results}, fw, indent=2)
+    print(f"benchmark results: {args.output}")
+    instrumentation.finish()
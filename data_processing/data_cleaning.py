@@ -1,109 +1,105 @@
+import numpy as np
 import pandas as pd
 import os
-import random
-
-# Function which try to set the value into NaN value in the combined_data
-def clean_data(combined_data_file, cleaned_data_file):
-    data = pd.read_csv(combined_data_file)
-
-    # handle the row with NaN value
-    for index, row in data.iterrows():
-        if row.isnull().any():
-            soc_soe_id = row[' soc_sec_id']
-            # find the rows with the same soc_sec_id
-            same_soc_soe_id_rows = data[data[' soc_sec_id'] == soc_soe_id]
-            # if soc_sec_id is unique, delete dircetly如
-            if len(same_soc_soe_id_rows) == 1:
-                data = data.drop(index)
-            else:
-                # find the column with NaN in the same soc_sec_id
-                nan_columns = row[row.isnull()].index.tolist()
-                for column in nan_columns:
-                    # find other column with same soc_sec_id
-                    other_values = same_soc_soe_id_rows[column].dropna()
-                    if len(other_values) == 0:
-                        # id other column also NaN in the same soc_sec_id, delete all relevant rows
-                        data = data[data[' soc_sec_id'] != soc_soe_id]
-                        break
-                    else:
-                        # find the value with most frequency
-                        most_common_value = other_values.mode()[0]
-                        # replace NaN with most frequency value
-                        data.at[index, column] = most_common_value
-
-    data.to_csv(cleaned_data_file, index=False)
+
+import instrumentation
+import schema
+
+# string edits of add_noise_to_data
+noise_edits = ("insert", "delete", "substitute", "transpose")
+
+# Function which try to set the value into NaN value in the combined_data.
+# every stage takes a csv file or the dataframe returned by the stage before it, writes its output
+# file unless it is None and returns its result, so the stages can run without csv round-trips
+@instrumentation.timed()
+def clean_data(combined_data_file, cleaned_data_file=None):
+    data = schema.read_frame(combined_data_file)
+    instrumentation.count_rows(len(data))
+    data = impute_by_soc_sec_id(data)
+
+    schema.write_frame(data, cleaned_data_file)
     print('data cleaning is finshed')
+    return data
+
+# Function which fills the NaN values with the most frequent value of the same soc_sec_id
+def impute_by_soc_sec_id(data, id_column=' soc_sec_id'):
+    # if a column is NaN in every row of a soc_sec_id, delete all relevant rows,
+    # this also deletes a unique soc_sec_id with a NaN value
+    has_value = data.notnull().groupby(data[id_column]).any()
+    all_nan_ids = has_value.index[~has_value.all(axis=1)]
+    del has_value
+    data = data[~data[id_column].isin(all_nan_ids)].copy()
+
+    nan_columns = [column for column in data.columns if column != id_column and data[column].isnull().any()]
+    for column in nan_columns:
+        # the value with most frequency in every soc_sec_id, the smallest one on a tie like Series.mode
+        # only the observed values, a categorical column would count every category of every soc_sec_id
+        counts = data.groupby([id_column, column], observed=True).size().reset_index(name='count')
+        counts = counts.sort_values([id_column, 'count', column], ascending=[True, False, True])
+        most_common_value = counts.drop_duplicates(id_column).set_index(id_column)[column]
+        # replace NaN with most frequency value
+        data[column] = data[column].where(data[column].notnull(), data[id_column].map(most_common_value))
+    return data
 
 # Function of merging the febrl data with adult data, for sure that same soc_sec_id matching the same adult data
-def merge_data(cleaned_data_file, adult_data_file, merged_data_file):
-
-    cleaned_data = pd.read_csv(cleaned_data_file)
-    adult_data = pd.read_csv(adult_data_file)
-
-    # put soc_sec_id into two lists: unique and ununique
-    unique_ids = cleaned_data[' soc_sec_id'].unique().tolist()
-    ununique_ids = cleaned_data[cleaned_data.duplicated(subset=[' soc_sec_id'], keep=False)][
-        ' soc_sec_id'].unique().tolist()
-
-    # for soc_sec_id in the unique list, conact random with adult data
-    for soc_sec_id in unique_ids:
-        random_adult_data = adult_data.sample(n=1)
-        cleaned_data.loc[cleaned_data[' soc_sec_id'] == soc_sec_id, adult_data.columns] = random_adult_data.values
-
-    # for soc_sec_id in the ununique list sort at the first
-    ununique_ids.sort()
-
-    # initie pointers j and i
-    i = 0
-    j = 0
-
-    while i < len(ununique_ids) and j < len(adult_data):
-        soc_sec_id = ununique_ids[i]
-        # if i points the first soc_sec_id, conact one adult data randomly
-        if i == 0:
-            random_adult_data = adult_data.sample(n=1)
-            cleaned_data.loc[cleaned_data[' soc_sec_id'] == soc_sec_id, adult_data.columns] = random_adult_data.values
-            j += 1
-        else:
-            # if i not point the first soc_sec_id
-            prev_soc_sec_id = ununique_ids[i - 1]
-            if soc_sec_id == prev_soc_sec_id:
-                # if i = the prev soc_sec_id, put the data that j point in to data of soc_sec_id
-                cleaned_data.loc[cleaned_data[' soc_sec_id'] == soc_sec_id, adult_data.columns] = adult_data.iloc[
-                    j].values
-            else:
-                # if i =! prev soc_sec_id, random select adult data
-                random_adult_data = adult_data.sample(n=1)
-                cleaned_data.loc[
-                    cleaned_data[' soc_sec_id'] == soc_sec_id, adult_data.columns] = random_adult_data.values
-                j += 1
-        i += 1
+@instrumentation.timed()
+def merge_data(cleaned_data_file, adult_data_file, merged_data_file=None, seed=None):
+
+    cleaned_data = schema.read_frame(cleaned_data_file)
+    instrumentation.count_rows(len(cleaned_data))
+    adult_data = schema.read_frame(adult_data_file)
+
+    cleaned_data = attach_adult_data(cleaned_data, adult_data, np.random.default_rng(seed))
 
     # delete the adult data, which doesn't conact with any soc_sec_id
     cleaned_data = cleaned_data.dropna(subset=[' soc_sec_id'])
 
-    cleaned_data.to_csv(merged_data_file, index=False)
+    schema.write_frame(cleaned_data, merged_data_file)
     print('data merging is finished')
+    return cleaned_data
+
+# Function which draws one adult row for every soc_sec_id and joins the adult columns in one pass
+def attach_adult_data(cleaned_data, adult_data, rng, id_column=' soc_sec_id'):
+    # every soc_sec_id gets a random adult row, the rows of the same soc_sec_id share it.
+    # the ununique soc_sec_id used to be drawn a second time in sorted order, reusing the previous
+    # adult row only for a repeated soc_sec_id, which never happens in the de-duplicated list,
+    # so one independent draw per soc_sec_id gives the same assignment
+    ids = np.sort(cleaned_data[id_column].dropna().unique())
+    draws = rng.integers(0, len(adult_data), size=len(ids))
+
+    assigned = adult_data.iloc[draws].set_index(pd.Index(ids, name=id_column))
+    return cleaned_data.join(assigned, on=id_column)
 
 # function which processes the merged data
-def process_merged_data(merged_data_file, processed_data_file):
-    merged_data = pd.read_csv(merged_data_file)
+@instrumentation.timed()
+def process_merged_data(merged_data_file, processed_data_file=None):
+    merged_data = schema.read_frame(merged_data_file)
+    instrumentation.count_rows(len(merged_data))
     #delete the space in the colums
     merged_data.columns = merged_data.columns.str.strip()
     columns_to_drop = ['rec_id', 'ID', 'sex', 'age', 'race', 'marital-status', 'education', 'native-country',
                        'workclass', 'occupation']
     merged_data = merged_data.drop(columns=columns_to_drop, errors='ignore')
     # delete the postcode which don't have length of 4
-    merged_data = merged_data[merged_data['postcode'].astype(str).str.len() == 4]
-    # change the datatype
-    merged_data['street_number'] = merged_data['street_number'].astype(int)
-    merged_data['date_of_birth'] = merged_data['date_of_birth'].astype(int)
-    merged_data.to_csv(processed_data_file, index=False)
+    postcode = merged_data['postcode']
+    if pd.api.types.is_integer_dtype(postcode):
+        # the integers of four characters, without a python string per row
+        four_characters = (postcode.between(1000, 9999) | postcode.between(-999, -100)).fillna(False)
+    else:
+        four_characters = postcode.notna() & (postcode.astype(str).str.len() == 4)
+    merged_data = merged_data[four_characters.astype(bool)]
+    # change the datatype, to the smallest integers
+    merged_data['street_number'] = schema.downcast_integer(merged_data['street_number'].astype(int))
+    merged_data['date_of_birth'] = schema.downcast_integer(merged_data['date_of_birth'].astype(int))
+    schema.write_frame(merged_data, processed_data_file)
     print('data process is finished')
+    return merged_data
 
 # function which splite the data into two csv files
-def split_and_remove_duplicates(processed_data_file, dataset_a_file, dataset_b_file):
-    processed_data = pd.read_csv(processed_data_file)
+@instrumentation.timed()
+def split_and_remove_duplicates(processed_data_file, dataset_a_file=None, dataset_b_file=None):
+    processed_data = schema.read_frame(processed_data_file)
+    instrumentation.count_rows(len(processed_data))
 
     # Split data into two equal parts
     num_rows = processed_data.shape[0]
@@ -120,42 +116,70 @@ def split_and_remove_duplicates(processed_data_file, dataset_a_file, dataset_b_f
     dataset_b.insert(0, 'index', [str(i) + '_b' for i in range(1, 1 + len(dataset_b))])
 
     # Save datasets A and B to CSV files
-    dataset_a.to_csv(dataset_a_file, index=False)
-    dataset_b.to_csv(dataset_b_file, index=False)
+    schema.write_frame(dataset_a, dataset_a_file)
+    schema.write_frame(dataset_b, dataset_b_file)
     print('data is spliting into two csvs and duplicates is removed')
+    return dataset_a, dataset_b
 
-# function to add randomly noise of the data
-def add_noise_to_data(data_file, target_column):
-    data = pd.read_csv(data_file)
+# function to add randomly noise of the data, a csv file is overwritten, a dataframe is returned with the noise
+@instrumentation.timed()
+def add_noise_to_data(data_file, target_column, rate=0.2, seed=None, edits=noise_edits):
+    data = schema.read_frame(data_file)
+    instrumentation.count_rows(len(data))
 
-    # calculate the percentage of  rows that need to add noise
-    num_rows = data.shape[0]
-    num_rows_to_add_noise = int(0.2 * num_rows)
+    data = add_noise(data, target_column, np.random.default_rng(seed), rate, edits)
 
-    # randomly select rows
-    rows_to_add_noise = random.sample(range(num_rows), num_rows_to_add_noise)
+    schema.write_frame(data, None if isinstance(data_file, pd.DataFrame) else data_file)
+    print('data is added by noise')
+    return data
 
-    for row_index in rows_to_add_noise:
-        current_value = data.loc[row_index, target_column]
+# function which adds noise to every target column, the rate applies to each column
+def add_noise(data, target_column, rng, rate=0.2, edits=noise_edits):
+    columns = [target_column] if isinstance(target_column, str) else list(target_column)
 
+    # calculate the percentage of  rows that need to add noise
+    num_rows = data.shape[0]
+    num_rows_to_add_noise = int(rate * num_rows)
+
+    for column in columns:
+        if not schema.is_text(data[column]):
+            continue
+        # randomly select rows
+        rows = rng.choice(num_rows, size=num_rows_to_add_noise, replace=False)
+        values = data[column].iloc[rows]
         # if value length>3, added noise
-        if isinstance(current_value, str) and len(current_value) > 3:
-            # randomly select method to add noise: delete or add string
-            noise_choice = random.choice(["delete", "add"])
-
-            if noise_choice == "delete":
-                delete_index = random.randint(0, len(current_value) - 1)
-                new_value = current_value[:delete_index] + current_value[delete_index + 1:]
-
-            elif noise_choice == "add":
-                insert_index = random.randint(0, len(current_value))
-                insert_char = chr(random.randint(97, 122))  # 随机选择小写字母
-                new_value = current_value[:insert_index] + insert_char + current_value[insert_index:]
-
-            data.loc[row_index, target_column] = new_value
-
-    data.to_csv(data_file, index=False)
-    print('data is added by noise')
+        lengths = values.str.len()
+        selected = (lengths > 3).fillna(False).to_numpy(dtype=bool)
+        rows = rows[selected]
+        values = values[selected].tolist()
+
+        # randomly select method, position and character of every edit
+        methods = rng.integers(0, len(edits), size=len(rows))
+        positions = rng.random(len(rows))
+        chars = rng.integers(97, 123, size=len(rows))
+        new_values = [edit_value(value, edits[method], position, chr(char))
+                      for value, method, position, char in zip(values, methods, positions, chars)]
+        # the edits make new values, a categorical column is edited as text and categorized again
+        series = data[column].astype(object)
+        series.iloc[rows] = new_values
+        data[column] = schema.to_category(series) if isinstance(data[column].dtype, pd.CategoricalDtype) else series
+    return data
+
+# function which applies one edit to a string, position is a fraction of its length
+def edit_value(value, method, position, char):
+    if method == "insert":
+        index = int(position * (len(value) + 1))
+        return value[:index] + char + value[index:]
+    if method == "delete":
+        index = int(position * len(value))
+        return value[:index] + value[index + 1:]
+    if method == "substitute":
+        index = int(position * len(value))
+        return value[:index] + char + value[index + 1:]
+    if method == "transpose":
+        index = int(position * (len(value) - 1))
+        return value[:index] + value[index + 1] + value[index] + value[index + 2:]
+    raise ValueError("unknown noise method: %s" % method)
 
 if __name__ == "__main__":
     combined_data_file = "../datasets/combined_data.csv"
@@ -166,11 +190,13 @@ if __name__ == "__main__":
     dataset_a_file = "../datasets/datasetsA/dataset_a.csv"
     dataset_b_file = "../datasets/datasetsB/dataset_b.csv"
 
-    clean_data(combined_data_file, cleaned_data_file)
-    merge_data(cleaned_data_file,adult_data_file,merged_data_file)
-    process_merged_data(merged_data_file, processed_data_file)
-    split_and_remove_duplicates(processed_data_file, dataset_a_file, dataset_b_file)
+    # the stages pass their dataframes on, the csv files are only written
+    cleaned_data = clean_data(combined_data_file, cleaned_data_file)
+    merged_data = merge_data(cleaned_data,adult_data_file,merged_data_file)
+    processed_data = process_merged_data(merged_data, processed_data_file)
+    split_and_remove_duplicates(processed_data, dataset_a_file, dataset_b_file)
     add_noise_to_data(dataset_a_file, ['given_name', 'surname', 'address_1', 'address_2', 'suburb', 'state'])
     add_noise_to_data(dataset_b_file, ['given_name', 'surname', 'address_1', 'address_2', 'suburb', 'state'])
+    instrumentation.finish()
 
 
@@ -1,46 +1,145 @@
 import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+
+import numpy as np
 import pandas as pd
 
+import instrumentation
+
+default_output_file = '../datasets/combined_data.csv'
+
+# data types of the febrl csv files, the column names keep the space after the comma
+febrl_dtypes = {
+    'rec_id': str,
+    ' given_name': str,
+    ' surname': str,
+    ' street_number': 'float64',
+    ' address_1': str,
+    ' address_2': str,
+    ' suburb': str,
+    ' postcode': 'Int64',
+    ' state': str,
+    ' date_of_birth': 'float64',
+    ' soc_sec_id': 'Int64',
+}
+
 # function which load the all csv data in to one csv data
-def load_data(folder_path):
+@instrumentation.timed()
+def load_data(folder_path, output_file=default_output_file, dtype=None, workers=None, chunksize=None):
+    # dtype defaults to febrl_dtypes, the files are read by a thread pool of workers,
+    # with a chunksize every file is normalized chunk by chunk and streamed to the output
 
-    csv_files = [f for f in os.listdir(folder_path) if f.endswith('.csv')]
+    csv_files = sorted(f for f in os.listdir(folder_path) if f.endswith('.csv'))
 
     if not csv_files:
         print("There are now csv file in the folder")
         return
 
+    if dtype is None:
+        dtype = febrl_dtypes
+    file_paths = [os.path.join(folder_path, file) for file in csv_files]
+
     # read all csv files and conact into one dataframe
-    dfs = []
-    for file in csv_files:
-        file_path = os.path.join(folder_path, file)
-        # replace the space value into NaN
-        df = pd.read_csv(file_path)
-        df.replace(r'^\s*$', float('nan'), regex=True, inplace=True)
-        dfs.append(df)
-    combined_df = pd.concat(dfs, ignore_index=True)
-
-    # Data information
-    file_size = sum(os.path.getsize(os.path.join(folder_path, file)) for file in csv_files)
-    num_rows = combined_df.shape[0]
-    num_columns = combined_df.shape[1]
-    missing_values = combined_df.isnull().sum().sum()
-    missing_values_percentage = (missing_values / (num_rows * num_columns)) * 100
-    column_types = combined_df.dtypes
+    combined_df = None
+    if chunksize:
+        with tempfile.TemporaryDirectory() as folder:
+            parts = [os.path.join(folder, "part_%d.csv" % i) for i in range(len(file_paths))]
+            headers = [True] + [False] * (len(parts) - 1)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                summaries = list(executor.map(stream_csv, file_paths, parts, repeat(dtype), repeat(chunksize), headers))
+            with open(output_file, 'wb') as fout:
+                for part in parts:
+                    with open(part, 'rb') as fin:
+                        shutil.copyfileobj(fin, fout)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(read_csv, file_paths, repeat(dtype)))
+        combined_df = pd.concat([df for df, _ in results], ignore_index=True)
+        summaries = [summary for _, summary in results]
+        combined_df.to_csv(output_file, index=False)
 
-    rows_with_blank_values = combined_df.apply(lambda row: row.str.isspace().any(), axis=1).sum()
+    # Data information, summed column-wise over the files
+    summary = merge_summaries(summaries)
+    file_size = sum(os.path.getsize(file_path) for file_path in file_paths)
+    num_rows = summary['rows']
+    instrumentation.count_rows(num_rows)
+    num_columns = len(summary['missing'])
+    missing_values = summary['missing'].sum()
+    missing_values_percentage = (missing_values / (num_rows * num_columns)) * 100
+    rows_with_blank_values = summary['blank_rows']
     rows_with_blank_values_percentage = (rows_with_blank_values / num_rows) * 100
 
-    combined_df.to_csv('../datasets/combined_data.csv', index=False)
-
     print("file size: {:.2f} bytes".format(file_size))
     print("Total number of data: {}".format(num_rows))
     print("Number of missing values: {}".format(missing_values))
     print("Percentage of missing values: {:.2f}%".format(missing_values_percentage))
+    print("Number of rows with blank values: {} ({:.2f}%)".format(rows_with_blank_values,
+                                                                 rows_with_blank_values_percentage))
     print("\nData type of each column:")
-    print(column_types)
+    print(summary['dtypes'])
+    return combined_df
+
+# function which reads one csv file into a dataframe with blank values as NaN
+def read_csv(file_path, dtype):
+    dtype = dtype_of(file_path, dtype)
+    df = pd.read_csv(file_path, dtype=text_dtype(dtype))
+    blank_rows = normalize_blanks(df, dtype)
+    return df, summarize(df, blank_rows)
+
+# function which normalizes one csv file chunk by chunk into the part file of the output
+def stream_csv(file_path, part_path, dtype, chunksize, header):
+    summaries = []
+    dtype = dtype_of(file_path, dtype)
+    with open(part_path, 'w', newline='') as fout:
+        for chunk in pd.read_csv(file_path, dtype=text_dtype(dtype), chunksize=chunksize):
+            blank_rows = normalize_blanks(chunk, dtype)
+            chunk.to_csv(fout, index=False, header=header)
+            header = False
+            summaries.append(summarize(chunk, blank_rows))
+    if not summaries:
+        empty = pd.read_csv(file_path, dtype=dtype, nrows=0)
+        empty.to_csv(part_path, index=False, header=header)
+        summaries.append(summarize(empty, 0))
+    return merge_summaries(summaries)
+
+def dtype_of(file_path, dtype):
+    # only the dtypes of the columns in the header of the file
+    columns = pd.read_csv(file_path, nrows=0).columns
+    return {column: value for column, value in dtype.items() if column in columns}
+
+def text_dtype(dtype):
+    # numeric columns are read as text first, a space value can not be parsed as a number
+    return {column: str if value != str else value for column, value in dtype.items()}
+
+# function which replaces the space values into NaN column by column and sets the data types
+def normalize_blanks(df, dtype):
+    blank_rows = np.zeros(len(df), dtype=bool)
+    for column in df.columns:
+        if df[column].dtype == object:
+            blank = df[column].str.strip().eq('').fillna(False).to_numpy(dtype=bool)
+            if blank.any():
+                df.loc[blank, column] = np.nan
+                blank_rows |= blank
+        if column in dtype and dtype[column] != str:
+            df[column] = pd.to_numeric(df[column]).astype(dtype[column])
+    return int(blank_rows.sum())
+
+def summarize(df, blank_rows):
+    return {'rows': len(df), 'missing': df.isnull().sum(), 'blank_rows': blank_rows, 'dtypes': df.dtypes}
+
+def merge_summaries(summaries):
+    return {
+        'rows': sum(summary['rows'] for summary in summaries),
+        'missing': pd.concat([summary['missing'] for summary in summaries], axis=1).fillna(0).sum(axis=1).astype(int),
+        'blank_rows': sum(summary['blank_rows'] for summary in summaries),
+        'dtypes': summaries[0]['dtypes'],
+    }
 
 
 if __name__ == "__main__":
     folder_path = "/Users/lixiaoying/Desktop/Masterarbeit/Projekt/data"
-    load_data(folder_path)
\ No newline at end of file
+    load_data(folder_path)
+    instrumentation.finish()
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+# memory-efficient dtypes of the febrl and adult columns, shared by the preprocessing stages.
+# the columns are looked up without the space after the comma of the febrl csv files.
+# the text columns repeat their values, they are parsed into categorical codes, only the record ids
+# like rec_id and index stay python strings
+category_columns = ['given_name', 'surname', 'address_1', 'address_2', 'suburb', 'state', 'sex', 'race',
+                    'marital-status', 'education', 'native-country', 'workclass', 'occupation', 'salary-class']
+integer_columns = ['street_number', 'postcode', 'date_of_birth', 'soc_sec_id', 'ID', 'age']
+
+
+# function which reads a csv file with the schema, a dataframe passed between stages is used as it is
+def read_frame(source, **kwargs):
+    if isinstance(source, pd.DataFrame):
+        # a shallow copy, the stages assign columns without changing the frame of the caller
+        return source.copy(deep=False)
+    columns = pd.read_csv(source, nrows=0, **kwargs).columns
+    dtype = {column: 'category' for column in columns if column.strip() in category_columns}
+    return apply_schema(pd.read_csv(source, dtype=dtype, **kwargs))
+
+
+# function which writes a stage result when a file is given, it returns the frame for the next stage
+def write_frame(data, output_file):
+    if output_file is not None:
+        data.to_csv(output_file, index=False)
+    return data
+
+
+# function which sets the dtypes of the schema on every column of a dataframe
+def apply_schema(data):
+    for column in data.columns:
+        name = column.strip()
+        if name in integer_columns:
+            data[column] = downcast_integer(data[column])
+        elif name in category_columns:
+            data[column] = to_category(data[column])
+    return data
+
+
+# function which casts a numeric column to the smallest integer dtype of its values, a nullable one
+# when values are missing, a column with fractions or text keeps its dtype
+def downcast_integer(series):
+    if not pd.api.types.is_numeric_dtype(series):
+        return series
+    present = series.dropna()
+    if len(present) and not np.array_equal(present, np.floor(present)):
+        return series
+    series = pd.to_numeric(series.astype('Int64'), downcast='integer')
+    if series.isna().any():
+        return series
+    return series.astype(series.dtype.numpy_dtype)
+
+
+# function which casts a column to a categorical one with sorted categories, so it sorts like its text,
+# read_csv does not sort the categories of a file read in several chunks
+def to_category(series):
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype('category')
+    if series.cat.categories.is_monotonic_increasing:
+        return series
+    return series.cat.reorder_categories(series.cat.categories.sort_values())
+
+
+def is_text(series):
+    return series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype)
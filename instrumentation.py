@@ -0,0 +1,220 @@
+import cProfile
+import json
+import os
+import platform
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+# LINKAGE_REPORT=report.json writes the report of a run when it finishes,
+# LINKAGE_PROFILE=cprofile,tracemalloc switches on the profilers
+report_variable = "LINKAGE_REPORT"
+profile_variable = "LINKAGE_PROFILE"
+profilers = ["cprofile", "tracemalloc"]
+default_profile_rows = 30
+
+
+class Recorder(object):
+    """
+    Timers of the stages of a run: wall time, row throughput and the peak rss of the process per stage,
+    the peak traced memory per stage and a cProfile of the whole run when the profilers are on.
+    Stages nest, a stage started inside another one of the same thread records it as its parent,
+    every thread has its own stack of running stages, so concurrent runs record apart. The traced
+    memory of tracemalloc is process wide, the per-stage peaks are only valid for single-threaded runs.
+    """
+
+    def __init__(self, report_file=None, profile=()):
+        """
+        :param report_file: json file written by finish, None writes no report
+        :param profile: names of the profilers to run, see profilers
+        """
+        self.report_file = report_file
+        self.profile = set()
+        self.profiler = None
+        self.stages = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.created = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.enable(profile)
+
+    @property
+    def stack(self):
+        # the running stages of the calling thread
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def enable(self, profile):
+        unknown = set(profile) - set(profilers)
+        if unknown:
+            raise ValueError(f"unknown profilers {sorted(unknown)}, any of {profilers}")
+        self.profile |= set(profile)
+        if "tracemalloc" in self.profile and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if "cprofile" in self.profile and self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        time the body of a with block, the rows can be added by count_rows inside the block
+        :return: the record of the stage, it is complete when the block exits
+        """
+        record = {
+            "name": name,
+            "parent": self.stack[-1][0]["name"] if self.stack else None,
+            "thread": threading.current_thread().name,
+            "seconds": None,
+            "rows": rows,
+            "rows_per_second": None,
+            "max_rss_bytes": None,
+            "peak_traced_bytes": None,
+        }
+        # the stack holds the record and the peak traced memory of every running stage of the thread
+        frame = [record, 0]
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            # the peak of the enclosing stage so far is kept before the peak is reset for this one
+            if self.stack:
+                self.stack[-1][1] = max(self.stack[-1][1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            self.stack.pop()
+            record["seconds"] = seconds
+            if record["rows"] and seconds > 0:
+                record["rows_per_second"] = record["rows"] / seconds
+            record["max_rss_bytes"] = max_rss()
+            if tracing and tracemalloc.is_tracing():
+                record["peak_traced_bytes"] = max(frame[1], tracemalloc.get_traced_memory()[1])
+                if self.stack:
+                    self.stack[-1][1] = max(self.stack[-1][1], record["peak_traced_bytes"])
+            with self.lock:
+                self.stages.append(record)
+
+    def count_rows(self, rows):
+        # add rows to the innermost running stage of the calling thread
+        if self.stack:
+            record = self.stack[-1][0]
+            record["rows"] = (record["rows"] or 0) + rows
+
+    def report(self, profile_rows=default_profile_rows):
+        report = {
+            "created": self.created,
+            "argv": sys.argv,
+            "environment": environment(),
+            "profile": sorted(self.profile),
+            "stages": self.stages,
+        }
+        if self.profiler is not None:
+            report["cprofile"] = cprofile_rows(self.profiler, profile_rows)
+        if tracemalloc.is_tracing():
+            statistics = tracemalloc.take_snapshot().statistics("lineno")[:profile_rows]
+            report["tracemalloc"] = [{"line": str(statistic.traceback), "bytes": statistic.size,
+                                      "blocks": statistic.count} for statistic in statistics]
+        return report
+
+    def finish(self):
+        """
+        stop the profilers and write the report, the cProfile stats are also written next to the
+        report as <report>.prof for pstats or snakeviz
+        :return: the report
+        """
+        if self.profiler is not None:
+            self.profiler.disable()
+        report = self.report()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if self.report_file:
+            folder = os.path.dirname(self.report_file)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            with open(self.report_file, "w") as fw:
+                json.dump(report, fw, indent=2)
+            if self.profiler is not None:
+                self.profiler.dump_stats(self.report_file + ".prof")
+            print(f"instrumentation report: {self.report_file}")
+        return report
+
+
+def parse_profile(text):
+    return [item.strip() for item in (text or "").split(",") if item.strip()]
+
+
+def max_rss():
+    # ru_maxrss is in kilobytes on linux and in bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def cprofile_rows(profiler, count):
+    # the functions with the largest cumulative time
+    stats = pstats.Stats(profiler)
+    stats.sort_stats("cumulative")
+    rows = []
+    for function in stats.fcn_list[:count]:
+        _, calls, total, cumulative, _ = stats.stats[function]
+        rows.append({"function": "%s:%d(%s)" % function, "calls": calls, "total_seconds": total,
+                     "cumulative_seconds": cumulative})
+    return rows
+
+
+def environment():
+    versions = {name: getattr(sys.modules[name], "__version__", None)
+                for name in ["numpy", "pandas", "recordlinkage", "sklearn"] if name in sys.modules}
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        **versions,
+    }
+
+
+# recorder of the process, configured from the environment and by configure
+recorder = Recorder(os.environ.get(report_variable), parse_profile(os.environ.get(profile_variable)))
+
+
+def configure(report_file=None, profile=()):
+    """
+    set the report file and switch on profilers of the process recorder, e.g. from cli flags,
+    the environment variables stay in effect for what is not given
+    """
+    if report_file:
+        recorder.report_file = report_file
+    recorder.enable(profile)
+    return recorder
+
+
+def stage(name, rows=None):
+    return recorder.stage(name, rows)
+
+
+def count_rows(rows):
+    recorder.count_rows(rows)
+
+
+def timed(name=None):
+    """
+    decorator which runs every call of a function as a stage
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with recorder.stage(name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def finish():
+    return recorder.finish()
@@ -1,21 +1,55 @@
 import argparse
 import copy
 import csv
+import json
 import os
 import sys
+import numpy as np
 import pandas as pd
 
+import instrumentation
+from mondrian_numpy import NumpyMondrian, default_parallel_threshold
+from mondrian_stream import StreamingMondrian, default_partition_size
+from mondrian_incremental import IncrementalMondrian
+from mondrian_metrics import MondrianMetrics
+from mondrian_generalize import (default_schema, attribute_kind, parse_schema, records_frame, generalize,
+                                 verify_k_anonymity)
+
 
-QUASI_ID_INDEX = None
-RESULT1 = []
-RESULT2 = []
 args = sys.argv
 default_input_file = "../datasets/datasetsA/dataset_a.csv"
 default_output_file = r"output/output_dataset_a.csv"
 default_quality_index = [3, 7, 8, 9]
 default_k = 3
+default_engine = "python"
+default_output_format = "csv"
+
+
+def anonymize(records, qi, k, workers=None, threshold=default_parallel_threshold, metrics=None):
+    """
+    Mondrian partitioning which keeps all of its state in the call, so it can run
+    concurrently for several datasets in the same process
+    :param records: list of record tuples, e.g. from FileHandle.read_source_data
+    :param qi: indices of the quasi-identifier columns
+    :param k: k value of the k-anonymity
+    :param workers: number of worker processes, None runs serially
+    :param threshold: minimum partition size sent to a worker process
+    :param metrics: MondrianMetrics which adds up the information loss of the partitions
+    :return: generator of the partitions, each one a list of records
+    """
+    engine = NumpyMondrian(records, qi, k, metrics)
+    if workers:
+        partitions = engine.iter_partitions_parallel(workers, threshold)
+    else:
+        partitions = engine.iter_partitions()
+    for index in partitions:
+        yield [records[i] for i in index]
+
 
 class FileHandle(object):
+    headers = ["index","street_number", "postcode", "state", "date_of_birth","salary-class"]
+    exclude_cols = [1, 2, 4, 5, 6, 10]
+
     def __init__(self):
         pass
 
@@ -31,6 +65,22 @@ class FileHandle(object):
         data_drop_header = new_data[1:]
         return data_drop_header
 
+    @staticmethod
+    def iter_source_data(file):
+        """
+        read data one record at a time, same records as read_source_data
+        :param file: link to the input file
+        """
+        with open(file, "r") as fr:
+            header = True
+            for item in fr:
+                if not item.strip():
+                    continue
+                if header:
+                    header = False
+                    continue
+                yield tuple(item.strip().split(","))
+
     @staticmethod
     def dump_result(dataset, output_filename):
         """
@@ -38,14 +88,90 @@ class FileHandle(object):
         :param dataset: datasets after anonymization
         :param output_filename: link to the output file
         """
-        headers = ["index","street_number", "postcode", "state", "date_of_birth","salary-class"]
-        exclude_cols = [1, 2, 4, 5, 6, 10]
         with open(output_filename, "w", newline="", encoding="utf-8-sig") as fout:
-            writer = csv.writer(fout, dialect='excel')
-            writer.writerow(headers)
-            for data in dataset:
-                modify_row = [data[i] for i in range(len(data)) if i not in exclude_cols]
-                writer.writerow(modify_row)
+            writer = FileHandle.result_writer(fout)
+            FileHandle.dump_rows(writer, dataset)
+
+    @staticmethod
+    def dump_frame(frame, output_filename):
+        """
+        write the generalized rows of records_frame in bulk, the same file as dump_result
+        """
+        keep = [column for column in frame.columns if column not in FileHandle.exclude_cols]
+        frame[keep].to_csv(output_filename, index=False, header=FileHandle.headers, encoding="utf-8-sig",
+                           lineterminator="\r\n")
+
+    @staticmethod
+    def dump_frame_rows(frame, fout):
+        """
+        write the generalized rows of records_frame to an open output file, without the header
+        """
+        keep = [column for column in frame.columns if column not in FileHandle.exclude_cols]
+        frame[keep].to_csv(fout, index=False, header=False, lineterminator="\r\n")
+
+    @staticmethod
+    def result_writer(fout):
+        """
+        csv writer of the output file, the header is written at once
+        """
+        writer = csv.writer(fout, dialect='excel')
+        writer.writerow(FileHandle.headers)
+        return writer
+
+    @staticmethod
+    def dump_rows(writer, dataset):
+        """
+        write anonymized rows, without the excluded columns
+        """
+        exclude_cols = FileHandle.exclude_cols
+        for data in dataset:
+            modify_row = [data[i] for i in range(len(data)) if i not in exclude_cols]
+            writer.writerow(modify_row)
+
+    @staticmethod
+    def dump_bundle(classes, attribute_index, output_folder):
+        """
+        write result as a folder of .npy columns, which the linkage stage memory-maps without parsing.
+        A range column is stored as <name>_min.npy, <name>_max.npy and its midpoint <name>_mid.npy,
+        a set column as a bitmask <name>_mask.npy over <name>_vocabulary.npy, uint64 words of shape
+        (rows, ceil(items / 64)) where item i is bit i % 64 of word i // 64, every other column as
+        strings <name>.npy.
+        columns.npy holds the column names in output order.
+        :param classes: list of (partition, summary), summary from Process.summarise
+        :param attribute_index: indices of the quasi-identifier columns
+        :param output_folder: link to the output folder
+        """
+        os.makedirs(output_folder, exist_ok=True)
+        width = len(classes[0][0][0])
+        keep = [i for i in range(width) if i not in FileHandle.exclude_cols]
+        sizes = [len(partdata) for partdata, _ in classes]
+        np.save(os.path.join(output_folder, "columns.npy"), np.array(FileHandle.headers))
+
+        for name, column in zip(FileHandle.headers, keep):
+            path = os.path.join(output_folder, name)
+            if column not in attribute_index:
+                np.save(path + ".npy", np.array([data[column] for partdata, _ in classes for data in partdata]))
+                continue
+
+            values = [summary[attribute_index.index(column)] for _, summary in classes]
+            if all(isinstance(value, tuple) for value in values):
+                np.save(path + "_min.npy", np.repeat(np.array([value[0] for value in values], dtype=np.int64), sizes))
+                np.save(path + "_max.npy", np.repeat(np.array([value[1] for value in values], dtype=np.int64), sizes))
+                # the midpoint compared by the linkage stage, stored so it is memory-mapped too
+                np.save(path + "_mid.npy", np.repeat(np.array([(value[0] + value[1]) / 2 for value in values])
+                                                     .astype(np.int64), sizes))
+            elif any(isinstance(value, list) for value in values):
+                values = [value if isinstance(value, list) else [value] for value in values]
+                vocabulary = sorted(set(item.strip() for value in values for item in value))
+                positions = {item: i for i, item in enumerate(vocabulary)}
+                masks = np.zeros((len(values), max(1, -(-len(vocabulary) // 64))), dtype=np.uint64)
+                for row, value in enumerate(values):
+                    for position in set(positions[item.strip()] for item in value):
+                        masks[row, position // 64] |= np.uint64(1 << (position % 64))
+                np.save(path + "_mask.npy", np.repeat(masks, sizes, axis=0))
+                np.save(path + "_vocabulary.npy", np.array(vocabulary))
+            else:
+                np.save(path + ".npy", np.repeat(np.array(values), sizes))
 
 
 class Process(object):
@@ -53,6 +179,17 @@ class Process(object):
         self.input_file = kwargs.get("input_file")
         self.output_file = kwargs.get("output_file")
         self.k = kwargs.get("k")
+        self.engine = kwargs.get("engine") or default_engine
+        self.workers = kwargs.get("workers")
+        self.parallel_threshold = kwargs.get("parallel_threshold") or default_parallel_threshold
+        self.streaming = kwargs.get("streaming", False)
+        self.partition_size = kwargs.get("partition_size") or default_partition_size
+        self.output_format = kwargs.get("output_format") or default_output_format
+        self.incremental = kwargs.get("incremental")
+        self.schema = kwargs.get("schema") or default_schema
+        self.metrics_file = kwargs.get("metrics_file")
+        self.metrics = None
+        self.result = []
         attribute_index = kwargs.get("attribute_index")
         self.attribute_index = [int(item) for item in attribute_index]
 
@@ -140,23 +277,24 @@ class Process(object):
 
         data1_res = self.mondrian_process(data1, attribute_index, k)
         data2_res = self.mondrian_process(data2, attribute_index, k)
-        RESULT1.append(data1_res)
-        RESULT1.append(data2_res)
+        self.result.append(data1_res)
+        self.result.append(data2_res)
 
-    def anonymise(self, partdata, attribute_index):
+    def summarise(self, partdata, attribute_index):
         """
-        Mondrian anonymization
+        summary of a partition, one value per quasi-identifier by the kind of its schema:
+        (min, max) for a range, a sorted list for a set, a sorted list or a single value for a categorical
         """
         summary = list()
 
         for attr in attribute_index:
-            attr_list = [item[attr] for item in partdata]
-            attr_set = list(set(attr_list))
-            if attr in [3, 7, 9]:
+            attr_set = list(set(item[attr] for item in partdata))
+            kind = attribute_kind(self.schema, attr)
+            if kind == "range":
                 minmum_val = min(map(int, attr_set))
                 maxmum_val = max(map(int, attr_set))
-                summary.append("[%s-%s]" % (minmum_val, maxmum_val))
-            elif attr == 8:
+                summary.append((minmum_val, maxmum_val))
+            elif kind == "set":
                 # Merge all the data in this group as a list option
                 state_data = [item.strip() for item in attr_set]
                 state_data = list(set(state_data))
@@ -164,11 +302,21 @@ class Process(object):
                 summary.append(state_data)
             else:
                 if len(attr_set) > 1:
-                    attr_list.sort()
+                    attr_set.sort()
                     summary.append(attr_set)
                 else:
                     summary.append(attr_set[0])
 
+        return summary
+
+    def anonymise(self, partdata, attribute_index, summary=None):
+        """
+        Mondrian anonymization
+        """
+        if summary is None:
+            summary = self.summarise(partdata, attribute_index)
+        summary = ["[%s-%s]" % value if isinstance(value, tuple) else value for value in summary]
+
         anon_data = list()
         for data in partdata:
             __tmp = list(data)
@@ -178,60 +326,242 @@ class Process(object):
 
         return anon_data
 
+    def main_streaming(self):
+        """
+        out-of-core anonymization, the input is spilled into partition files and the output is written
+        a group of equivalence classes at a time, at most partition_size records are in memory.
+        The classes are checked for k before they are written, the output is removed when one is smaller.
+        """
+        file_handle = FileHandle()
+        streaming = StreamingMondrian(self.attribute_index, self.k, self.partition_size)
+        streaming.fit(file_handle.iter_source_data(self.input_file))
+
+        count = 0
+        smallest = self.k
+        with open(self.output_file, "w", newline="", encoding="utf-8-sig") as fout:
+            file_handle.result_writer(fout)
+            records = file_handle.iter_source_data(self.input_file)
+            partitions = []
+            size = 0
+            for partdata in streaming.iter_partitions(records, self.workers, self.parallel_threshold):
+                partitions.append(partdata)
+                size += len(partdata)
+                if size >= self.partition_size:
+                    smallest = min(smallest, self.dump_classes(fout, partitions))
+                    count += size
+                    partitions = []
+                    size = 0
+                    if smallest < self.k:
+                        break
+            if partitions and smallest >= self.k:
+                smallest = min(smallest, self.dump_classes(fout, partitions))
+                count += size
+
+        if smallest < self.k:
+            os.remove(self.output_file)
+            print(f"k value is too big，dataset can not spilt: {smallest}")
+        elif count:
+            print(f"data anonymization is successful, the address to the outputfile：{self.output_file}")
+        else:
+            os.remove(self.output_file)
+            print(f"dataset can not be anonymized数, k:{self.k}, input_quality:{self.attribute_index}")
+
+    def dump_classes(self, fout, partitions):
+        """
+        generalize and write a group of equivalence classes, nothing is written when one is smaller than k
+        :return: size of the smallest class
+        """
+        frame, class_id = records_frame(partitions)
+        generalize(frame, class_id, self.attribute_index, self.schema)
+        smallest = verify_k_anonymity(frame, self.attribute_index, self.k)
+        if smallest >= self.k:
+            FileHandle.dump_frame_rows(frame, fout)
+        return smallest
+
+    def main_incremental(self):
+        """
+        incremental anonymization, the partition tree is kept in the folder self.incremental.
+        The first run partitions the input file, every later run adds the records of the input file
+        to the anonymized dataset, then the whole output is written from the anonymized leaves.
+        """
+        file_handle = FileHandle()
+        dataset = file_handle.read_source_data(self.input_file)
+        try:
+            if IncrementalMondrian.exists(self.incremental):
+                incremental = IncrementalMondrian.load(self.incremental)
+                if incremental.k != self.k or incremental.attribute_index != self.attribute_index:
+                    raise ValueError(f"the partition tree is for k:{incremental.k}, "
+                                     f"input_quality:{incremental.attribute_index}")
+                touched = incremental.add(dataset)
+            else:
+                incremental = IncrementalMondrian(self.attribute_index, self.k, self.incremental)
+                touched = incremental.fit(dataset)
+        except ValueError as error:
+            print(f"dataset can not be anonymized数, {error}")
+            return
+
+        for leaf in touched:
+            partdata = incremental.read_leaf(leaf)
+            with open(incremental.anon_file(leaf), "w", newline="", encoding="utf-8") as fout:
+                file_handle.dump_rows(csv.writer(fout, dialect='excel'), self.anonymise(partdata, self.attribute_index))
+        incremental.save()
+
+        with open(self.output_file, "w", newline="", encoding="utf-8-sig") as fout:
+            file_handle.result_writer(fout)
+            for leaf in incremental.iter_leaves():
+                with open(incremental.anon_file(leaf), "r", newline="", encoding="utf-8") as fin:
+                    fout.write(fin.read())
+        print(f"data anonymization is successful, {len(dataset)} records in {len(touched)} changed classes, "
+              f"the address to the outputfile：{self.output_file}")
+
+    @instrumentation.timed("mondrian")
     def main(self):
-        global QUASI_ID_INDEX
-        QUASI_ID_INDEX = self.attribute_index
+        if self.streaming:
+            return self.main_streaming()
+        if self.incremental:
+            return self.main_incremental()
+
+        k = self.k
+        output_file = self.output_file
 
         file_handle = FileHandle()
         # read data
-        dataset = file_handle.read_source_data(input_file)
+        with instrumentation.stage("mondrian.read"):
+            dataset = file_handle.read_source_data(self.input_file)
+            instrumentation.count_rows(len(dataset))
         # implemente algorithm
-        self.mondrian_process(dataset, self.attribute_index, k)
-
-        # anonymizaion
-        for partdata in RESULT1:
-            if partdata:
-                RESULT2.extend(self.anonymise(partdata, self.attribute_index))
-
-        # check data for K format
-        for data in RESULT2:
-            if len(data) < k:
-                print(f"k value is too big，dataset can not spilt: {len(data)}")
-                return
-
-        if RESULT2:
-            file_handle.dump_result(RESULT2, output_file)
-            print(f"data anonymization is successful, the address to the outputfile：{output_file}")
-        else:
-            print(f"dataset can not be anonymized数, k:{k}, input_quality:{QUASI_ID_INDEX}")
+        with instrumentation.stage("mondrian.partition", len(dataset)):
+            if self.engine == "numpy":
+                self.metrics = MondrianMetrics(self.schema) if self.metrics_file else None
+                partitions = list(anonymize(dataset, self.attribute_index, k, self.workers, self.parallel_threshold,
+                                            self.metrics))
+            else:
+                self.result = []
+                self.mondrian_process(dataset, self.attribute_index, k)
+                partitions = self.result
+
+        partitions = [partdata for partdata in partitions if partdata]
+        if not partitions:
+            print(f"dataset can not be anonymized数, k:{k}, input_quality:{self.attribute_index}")
+            return
+
+        # anonymizaion, every class is summarised by one groupby per quasi-identifier
+        with instrumentation.stage("mondrian.generalize", len(dataset)):
+            frame, class_id = records_frame(partitions)
+            summaries = generalize(frame, class_id, self.attribute_index, self.schema, self.output_format == "npy")
+
+        # check the size of every equivalence class for K format
+        with instrumentation.stage("mondrian.verify", len(frame)):
+            smallest = verify_k_anonymity(frame, self.attribute_index, k)
+        if smallest < k:
+            print(f"k value is too big，dataset can not spilt: {smallest}")
+            return
+
+        with instrumentation.stage("mondrian.write", len(frame)):
+            if self.output_format == "npy":
+                file_handle.dump_bundle(list(zip(partitions, summaries)), self.attribute_index, output_file)
+            else:
+                file_handle.dump_frame(frame, output_file)
+        print(f"data anonymization is successful, the address to the outputfile：{output_file}")
+        if self.metrics is not None:
+            self.dump_metrics()
+
+    def dump_metrics(self):
+        """
+        print the information loss of the partitioning and write it to self.metrics_file
+        """
+        report = self.metrics.report()
+        for name, value in report.items():
+            print(f"{name}: {value}")
+        with open(self.metrics_file, "w") as fw:
+            json.dump(report, fw, indent=2)
 
 
 if __name__ == '__main__':
 
 
     if len(args) > 1:
-        # python demo.py --input_file dataset_a.csv --output_file output_a.csv --quality_index 3,7,8,9 --k 3
+        # PYTHONPATH=.. python Mondran.py --input_file dataset_a.csv --output_file output_a.csv --quality_index 3,7,8,9 --k 3
         parser = argparse.ArgumentParser()
         parser.add_argument('--input_file', required=True, help='input the input_file path.')
         parser.add_argument('--output_file', required=True, help='input the output_file path.')
         parser.add_argument('--quality_index', required=True, help='input the quality_index, if has more, please split , '
                                                                    'for example: 0,1,2,3.')
         parser.add_argument('--k', required=True, help='input the K')
+        parser.add_argument('--engine', default=default_engine, choices=['python', 'numpy'],
+                            help='input the Mondrian engine, numpy is the columnar engine for large datasets.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='input the number of worker processes of the numpy engine, default runs serially.')
+        parser.add_argument('--parallel_threshold', type=int, default=default_parallel_threshold,
+                            help='input the minimum partition size which is sent to a worker process.')
+        parser.add_argument('--streaming', action='store_true',
+                            help='anonymize out-of-core through on-disk partitions, for inputs larger than memory.')
+        parser.add_argument('--partition_size', type=int, default=default_partition_size,
+                            help='input the maximum number of records of an on-disk partition in streaming mode.')
+        parser.add_argument('--output_format', default=default_output_format, choices=['csv', 'npy'],
+                            help='input the output format, npy writes a folder of typed columns for the linkage stage.')
+        parser.add_argument('--incremental', default=None,
+                            help='input the folder of the partition tree, the records of input_file are added to '
+                                 'the anonymized dataset kept there, the first run creates it.')
+        parser.add_argument('--schema', default=None,
+                            help='input the generalization of the quality_index, attribute:kind with kind range, set '
+                                 'or categorical, for example: 3:range,7:range,8:set,9:range. A quality_index which '
+                                 'is not listed is categorical, default the schema of the febrl datasets.')
+        parser.add_argument('--metrics_file', default=None,
+                            help='input the json file of the information loss: discernibility, normalized certainty '
+                                 'penalty and average class size, needs the numpy engine.')
+        parser.add_argument('--report', default=None,
+                            help='input the json file of the stage timings, default the LINKAGE_REPORT variable.')
+        parser.add_argument('--profile', default=None,
+                            help='input the profilers to run, cprofile and/or tracemalloc, for example: '
+                                 'cprofile,tracemalloc. Default the LINKAGE_PROFILE variable.')
         args = parser.parse_args()
+        if args.streaming and args.output_format != 'csv':
+            parser.error('--streaming writes csv output only')
+        if args.incremental and (args.streaming or args.output_format != 'csv'):
+            parser.error('--incremental writes csv output only and does not combine with --streaming')
+        if args.metrics_file and (args.engine != 'numpy' or args.streaming or args.incremental):
+            parser.error('--metrics_file needs the numpy engine without --streaming or --incremental')
         input_file = args.input_file
         output_file = args.output_file
         quality_index = args.quality_index.split(",")
         quality_index = [int(item.strip()) for item in quality_index]
         k = int(args.k)
+        engine = args.engine
+        workers = args.workers
+        parallel_threshold = args.parallel_threshold
+        streaming = args.streaming
+        partition_size = args.partition_size
+        output_format = args.output_format
+        incremental = args.incremental
+        schema = parse_schema(args.schema) if args.schema else default_schema
+        metrics_file = args.metrics_file
+        try:
+            instrumentation.configure(args.report, instrumentation.parse_profile(args.profile))
+        except ValueError as error:
+            parser.error(str(error))
     else:
         input_file = default_input_file
         output_file = default_output_file
         quality_index = default_quality_index
         k = default_k
+        engine = default_engine
+        workers = None
+        parallel_threshold = default_parallel_threshold
+        streaming = False
+        partition_size = default_partition_size
+        output_format = default_output_format
+        incremental = None
+        schema = default_schema
+        metrics_file = None
 
     output_dir = os.path.dirname(output_file)
     os.makedirs(output_dir, exist_ok=True)
-    main = Process(input_file=input_file, attribute_index=quality_index, k=k, output_file=output_file)
+    main = Process(input_file=input_file, attribute_index=quality_index, k=k, output_file=output_file,
+                   engine=engine, workers=workers, parallel_threshold=parallel_threshold,
+                   streaming=streaming, partition_size=partition_size, output_format=output_format,
+                   incremental=incremental, schema=schema, metrics_file=metrics_file)
     main.main()
+    instrumentation.finish()
 
 
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+
+# kinds of generalization: the [min-max] range of an integer attribute, the sorted list of the
+# distinct stripped values of a set attribute, or a categorical value which becomes the list of
+# its distinct values when a class has more than one
+generalization_kinds = ["range", "set", "categorical"]
+# kind of every quasi-identifier of the febrl datasets, a column which is not in the schema is categorical
+default_schema = {3: "range", 7: "range", 8: "set", 9: "range"}
+
+
+def attribute_kind(schema, attribute):
+    return schema.get(attribute, "categorical")
+
+
+def parse_schema(text):
+    """
+    :param text: attribute:kind pairs, for example 3:range,7:range,8:set,9:range
+    """
+    schema = {}
+    for item in text.split(","):
+        attribute, kind = item.split(":")
+        if kind.strip() not in generalization_kinds:
+            raise ValueError(f"unknown generalization {kind}, one of {generalization_kinds}")
+        schema[int(attribute)] = kind.strip()
+    return schema
+
+
+def records_frame(partitions):
+    """
+    one frame of the records of all partitions in partition order, the columns are the record positions
+    :return: frame and the class id of every row
+    """
+    sizes = [len(partdata) for partdata in partitions]
+    frame = pd.DataFrame.from_records([data for partdata in partitions for data in partdata])
+    class_id = np.repeat(np.arange(len(sizes)), sizes)
+    return frame, class_id
+
+
+def summarise_attribute(values, class_id, kind, summaries=True):
+    """
+    summary of one attribute for every class, with one groupby over the class ids
+    :param summaries: also return the summaries like Process.summarise, the output only needs the strings
+    :return: summaries or None, and the output strings, both one per class
+    """
+    if kind == "range":
+        bounds = pd.DataFrame({"class": class_id, "value": pd.to_numeric(values).astype(np.int64)})
+        bounds = bounds.groupby("class", sort=True)["value"].agg(["min", "max"])
+        labels = ("[" + bounds["min"].astype(str) + "-" + bounds["max"].astype(str) + "]").to_numpy(dtype=object)
+        if summaries:
+            summaries = list(zip(bounds["min"].tolist(), bounds["max"].tolist()))
+        return summaries or None, labels
+
+    if kind == "set":
+        values = values.str.strip()
+    distinct = pd.DataFrame({"class": class_id, "value": values}).drop_duplicates().sort_values(["class", "value"])
+    classes = distinct["class"].to_numpy()
+    items = distinct["value"].to_numpy(dtype=object)
+    starts = np.flatnonzero(np.r_[True, classes[1:] != classes[:-1]])
+    counts = np.diff(np.r_[starts, len(items)])
+
+    # the string of a list is built by concatenating the reprs of its items per class,
+    # np.add.reduceat runs the concatenation without a python loop over the classes
+    unique_items, codes = np.unique(items.astype(str), return_inverse=True)
+    pieces = np.array([repr(item) for item in unique_items.tolist()], dtype=object)[codes]
+    follow = np.ones(len(items), dtype=bool)
+    follow[starts] = False
+    pieces[follow] = ", " + pieces[follow]
+    labels = "[" + np.add.reduceat(pieces, starts) + "]"
+    if kind == "categorical":
+        single = counts == 1
+        labels[single] = items[starts[single]]
+
+    if summaries:
+        summaries = [part.tolist() for part in np.split(items, starts[1:])]
+        if kind == "categorical":
+            summaries = [part if len(part) > 1 else part[0] for part in summaries]
+    return summaries or None, labels
+
+
+def generalize(frame, class_id, attribute_index, schema, summaries=False):
+    """
+    replace the quasi-identifiers of every row by the summary of its class, in place
+    :param summaries: return the summaries of every class, one value per quasi-identifier, e.g. for dump_bundle
+    """
+    columns = []
+    for attribute in attribute_index:
+        summary, labels = summarise_attribute(frame[attribute], class_id, attribute_kind(schema, attribute),
+                                              summaries)
+        frame[attribute] = labels[class_id]
+        columns.append(summary)
+    if summaries:
+        return [list(summary) for summary in zip(*columns)]
+
+
+def verify_k_anonymity(frame, attribute_index, k):
+    """
+    size of the smallest equivalence class, the rows are grouped by a 64 bit hash of their
+    quasi-identifier tuple in one pass, so the check is O(n)
+    :return: size of the smallest class, the frame is k-anonymous when it is at least k
+    """
+    if len(frame) == 0:
+        return 0
+    hashes = pd.util.hash_pandas_object(frame[list(attribute_index)], index=False)
+    return int(hashes.value_counts(sort=False).min())
@@ -0,0 +1,184 @@
+import json
+import os
+
+import numpy as np
+
+from mondrian_numpy import NumpyMondrian
+from mondrian_stream import StreamingMondrian, read_spill_file
+
+
+class IncrementalMondrian(object):
+    """
+    Mondrian partition tree kept on disk, so records can be added to an anonymized dataset
+    without partitioning it again.
+    Every split node keeps its attribute and split value, every leaf is an equivalence class whose
+    records live in leaf_<id>.csv and whose anonymized rows live in anon_<id>.csv.
+    New records are routed down the tree into their leaves, only the leaves which reach 2k records
+    are split again, so an append costs time proportional to the new records and the touched leaves.
+    """
+
+    def __init__(self, attribute_index, k, folder):
+        """
+        :param attribute_index: indices of the quasi-identifier columns
+        :param k: k value of the k-anonymity
+        :param folder: folder of the tree and the leaf files
+        """
+        self.attribute_index = list(attribute_index)
+        self.k = k
+        self.folder = folder
+        # a node is [attribute, split_value, left, right], a leaf is its id
+        self.tree = None
+        # id of a leaf -> number of records and the attributes its split may use
+        self.leaves = {}
+        self.next_leaf = 0
+
+    @classmethod
+    def load(cls, folder):
+        with open(os.path.join(folder, "tree.json"), "r") as fr:
+            state = json.load(fr)
+        incremental = cls(state["attribute_index"], state["k"], folder)
+        incremental.tree = state["tree"]
+        incremental.leaves = {int(leaf): value for leaf, value in state["leaves"].items()}
+        incremental.next_leaf = state["next_leaf"]
+        return incremental
+
+    @staticmethod
+    def exists(folder):
+        return os.path.exists(os.path.join(folder, "tree.json"))
+
+    def save(self):
+        state = {
+            "attribute_index": self.attribute_index,
+            "k": self.k,
+            "tree": self.tree,
+            "leaves": self.leaves,
+            "next_leaf": self.next_leaf,
+        }
+        tmp_file = os.path.join(self.folder, "tree.json.tmp")
+        with open(tmp_file, "w") as fw:
+            json.dump(state, fw)
+        os.replace(tmp_file, os.path.join(self.folder, "tree.json"))
+
+    def leaf_file(self, leaf):
+        return os.path.join(self.folder, "leaf_%d.csv" % leaf)
+
+    def anon_file(self, leaf):
+        return os.path.join(self.folder, "anon_%d.csv" % leaf)
+
+    def read_leaf(self, leaf):
+        return read_spill_file(self.leaf_file(leaf))
+
+    def fit(self, records):
+        """
+        partition a dataset from scratch
+        :return: ids of all leaves
+        """
+        if len(records) < self.k:
+            raise ValueError(f"dataset has {len(records)} records, less than k={self.k}")
+        os.makedirs(self.folder, exist_ok=True)
+        self.leaves = {}
+        self.next_leaf = 0
+        self.tree, created = self.build(records, self.attribute_index)
+        self.verify(created)
+        return created
+
+    def build(self, records, attribute_index):
+        """
+        partition records with the Mondrian splits of NumpyMondrian and write a file per leaf,
+        a partition which can not be split is one leaf
+        :return: subtree and the ids of its leaves
+        """
+        engine = NumpyMondrian(records, attribute_index, self.k)
+        created = []
+        root = [None]
+        stack = [(np.arange(engine.size), list(attribute_index), root, 0, None)]
+        while stack:
+            index, attribute_index, parent, position, summary = stack.pop()
+            split = engine.split(index, attribute_index, summary)
+            if split is None:
+                leaf = self.next_leaf
+                self.next_leaf += 1
+                self.leaves[leaf] = {"size": len(index), "attribute_index": attribute_index}
+                StreamingMondrian.flush(self.leaf_file(leaf), [",".join(records[i]) for i in index])
+                parent[position] = leaf
+                created.append(leaf)
+                continue
+
+            data1, data2, attribute_index, attribute, split_value, summary1, summary2 = split
+            node = [attribute, str(engine.values[attribute][split_value]), None, None]
+            parent[position] = node
+            stack.append((data2, attribute_index, node, 3, summary2))
+            stack.append((data1, attribute_index, node, 2, summary1))
+        return root[0], created
+
+    def locate(self, record):
+        """
+        leaf a record belongs to
+        :return: (node, position, leaf id), node[position] holds the leaf, node is None for a single leaf
+        """
+        parent, position = None, None
+        node = self.tree
+        while not isinstance(node, int):
+            attribute, split_value = node[0], node[1]
+            parent, position = node, 2 if record[attribute] <= split_value else 3
+            node = node[position]
+        return parent, position, node
+
+    def add(self, records):
+        """
+        route new records into their leaves and split the leaves which reached 2k records
+        :return: ids of the new or changed leaves, their anonymized rows have to be written again
+        """
+        buffers = {}
+        for record in records:
+            buffers.setdefault(self.locate(record)[2], []).append(record)
+
+        touched = []
+        for leaf, new_records in buffers.items():
+            StreamingMondrian.flush(self.leaf_file(leaf), [",".join(record) for record in new_records])
+            self.leaves[leaf]["size"] += len(new_records)
+            if self.leaves[leaf]["size"] < 2 * self.k:
+                touched.append(leaf)
+                continue
+
+            leaf_records = self.read_leaf(leaf)
+            engine = NumpyMondrian(leaf_records, self.leaves[leaf]["attribute_index"], self.k)
+            if engine.split(np.arange(engine.size), engine.attribute_index) is None:
+                touched.append(leaf)
+                continue
+
+            parent, position, _ = self.locate(new_records[0])
+            subtree, created = self.build(leaf_records, self.leaves[leaf]["attribute_index"])
+            if parent is None:
+                self.tree = subtree
+            else:
+                parent[position] = subtree
+            del self.leaves[leaf]
+            for file in [self.leaf_file(leaf), self.anon_file(leaf)]:
+                if os.path.exists(file):
+                    os.remove(file)
+            touched.extend(created)
+
+        self.verify(touched)
+        return touched
+
+    def verify(self, leaves):
+        """
+        check the k-anonymity of the given equivalence classes
+        """
+        small = [leaf for leaf in leaves if self.leaves[leaf]["size"] < self.k]
+        if small:
+            raise ValueError(f"equivalence classes {small} have less than k={self.k} records")
+
+    def iter_leaves(self):
+        """
+        leaf ids from left to right
+        """
+        stack = [self.tree]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, int):
+                yield node
+                continue
+            stack.append(node[3])
+            stack.append(node[2])
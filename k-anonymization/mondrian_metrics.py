@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+from mondrian_generalize import default_schema, attribute_kind
+
+
+def histogram(keys, size):
+    """
+    :param keys: integer keys in [0, size)
+    :return: (sorted distinct keys, their counts)
+    """
+    if size <= 4 * len(keys):
+        counts = np.bincount(keys, minlength=size)
+        values = np.flatnonzero(counts)
+        return values, counts[values]
+    # np.unique has a large overhead on the many small partitions at the bottom of the tree
+    keys = np.sort(keys)
+    first = np.empty(len(keys), dtype=bool)
+    first[:1] = True
+    np.not_equal(keys[1:], keys[:-1], out=first[1:])
+    starts = np.flatnonzero(first)
+    counts = np.empty(len(starts), dtype=np.int64)
+    counts[:-1] = starts[1:] - starts[:-1]
+    counts[-1:] = len(keys) - starts[-1:]
+    return keys[starts], counts
+
+
+def partition_keys(engine, index):
+    # the code of a quasi-identifier is offset by the cardinalities of the ones before it,
+    # so one histogram holds all of them
+    return (engine.columns[:, index] + engine.offsets[:-1, None]).ravel()
+
+
+def make_summary(engine, values, counts):
+    return values, counts, values.searchsorted(engine.offsets)
+
+
+def partition_summary(engine, index):
+    """
+    summary of a partition: the histogram of all quasi-identifiers as (keys, counts, bounds),
+    the keys of the i-th quasi-identifier are values[bounds[i]:bounds[i + 1]], so the distinct
+    count of every quasi-identifier is np.diff(bounds), and its min and max are the first and last key
+    """
+    return make_summary(engine, *histogram(partition_keys(engine, index), engine.offsets[-1]))
+
+
+def split_summary(engine, summary, data1, data2):
+    """
+    summaries of both halves of a split without counting the parent again, the smaller half is
+    counted and the larger half is the parent minus the smaller one
+    """
+    values, counts, _ = summary
+    small = data1 if len(data1) <= len(data2) else data2
+    small_values, small_counts = histogram(partition_keys(engine, small), engine.offsets[-1])
+    rest = counts.copy()
+    rest[values.searchsorted(small_values)] -= small_counts
+    keep = rest > 0
+    small_summary = make_summary(engine, small_values, small_counts)
+    large_summary = make_summary(engine, values[keep], rest[keep])
+    if small is data1:
+        return small_summary, large_summary
+    return large_summary, small_summary
+
+
+def attribute_codes(summary, offsets, row):
+    """
+    distinct codes of the quasi-identifier of the given row in a summary
+    """
+    values, _, bounds = summary
+    return values[bounds[row]:bounds[row + 1]] - offsets[row]
+
+
+class MondrianMetrics(object):
+    """
+    Information loss of a Mondrian partitioning, added up from the summaries of the equivalence
+    classes while NumpyMondrian splits, so it needs no pass over the data at the end.
+    - discernibility: sum of the squared class sizes
+    - normalized certainty penalty: per record and quasi-identifier, the width of the range of its class
+      over the width of the whole dataset for a range attribute, the distinct values of its class over
+      the distinct values of the dataset for the other kinds, 0 for a single value, averaged to [0, 1]
+    - average class size: records per class, and normalized by k
+    """
+
+    def __init__(self, schema=None):
+        """
+        :param schema: generalization kind of the quasi-identifiers, see mondrian_generalize
+        """
+        self.schema = schema or default_schema
+        self.k = None
+        self.offsets = None
+        # attribute -> numeric value of every code of a range attribute
+        self.numeric = {}
+        # attribute -> width of the dataset for a range attribute, distinct values for the others,
+        # in the order of the quasi-identifiers of the engine
+        self.totals = {}
+        self.reset()
+
+    def bind(self, engine, summary):
+        """
+        take the dataset wide ranges from the summary of the root partition
+        """
+        self.reset()
+        self.k = engine.k
+        self.offsets = engine.offsets
+        self.numeric = {}
+        self.totals = {}
+        for row, attribute in enumerate(engine.attribute_index):
+            values = attribute_codes(summary, self.offsets, row)
+            if attribute_kind(self.schema, attribute) == "range":
+                numeric = pd.to_numeric(engine.values[attribute], errors="coerce").astype(np.float64)
+                self.numeric[attribute] = numeric
+                present = numeric[values]
+                self.totals[attribute] = float(np.nanmax(present) - np.nanmin(present)) if len(present) else 0.0
+            else:
+                self.totals[attribute] = len(values)
+        return self
+
+    def reset(self):
+        self.records = 0
+        self.classes = 0
+        self.discernibility = 0
+        self.penalty = 0.0
+
+    def add_class(self, size, summary):
+        """
+        add one equivalence class from its summary
+        """
+        penalty = 0.0
+        for row, (attribute, total) in enumerate(self.totals.items()):
+            values = attribute_codes(summary, self.offsets, row)
+            if attribute in self.numeric:
+                numeric = self.numeric[attribute][values]
+                if total > 0:
+                    penalty += float(np.nanmax(numeric) - np.nanmin(numeric)) / total
+            elif len(values) > 1:
+                penalty += len(values) / total
+        self.records += size
+        self.classes += 1
+        self.discernibility += size * size
+        self.penalty += size * penalty
+
+    def state(self):
+        return self.records, self.classes, self.discernibility, self.penalty
+
+    def merge(self, state):
+        """
+        add the classes counted by another instance, e.g. in a pool worker
+        """
+        records, classes, discernibility, penalty = state
+        self.records += records
+        self.classes += classes
+        self.discernibility += discernibility
+        self.penalty += penalty
+
+    def report(self):
+        report = {
+            "k": self.k,
+            "records": self.records,
+            "classes": self.classes,
+            "discernibility": self.discernibility,
+            "normalized_certainty_penalty": None,
+            "average_class_size": None,
+            "normalized_average_class_size": None,
+        }
+        if self.classes:
+            report["normalized_certainty_penalty"] = self.penalty / (self.records * max(len(self.totals), 1))
+            report["average_class_size"] = self.records / self.classes
+            report["normalized_average_class_size"] = self.records / self.classes / self.k
+        return report
@@ -0,0 +1,262 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from mondrian_metrics import partition_summary, split_summary
+
+
+default_parallel_threshold = 10000
+# engine of a pool worker, built once from the shared column buffer by init_worker
+_WORKER_ENGINE = None
+_WORKER_MEMORY = None
+
+
+class NumpyMondrian(object):
+    """
+    Columnar Mondrian engine.
+    The quasi-identifier columns are encoded once into integer codes whose order follows the
+    sorted distinct values, so every split works on index arrays instead of copied tuple lists.
+    Every partition carries the histograms of its quasi-identifiers, which are derived from the
+    parent on a split, so the split attribute and its median are read from them.
+    It produces the same equivalence classes, in the same order, as Process.mondrian_process.
+    All state lives on the instance, so separate datasets can be partitioned concurrently.
+    """
+
+    def __init__(self, dataset, attribute_index, k, metrics=None):
+        """
+        :param dataset: list of record tuples, from FileHandle.read_source_data
+        :param attribute_index: indices of the quasi-identifier columns
+        :param k: k value of the k-anonymity
+        :param metrics: MondrianMetrics which receives every equivalence class
+        """
+        self.dataset = dataset
+        self.size = len(dataset)
+        self.attribute_index = list(attribute_index)
+        self.k = k
+        self.metrics = metrics
+        self.columns = np.empty((len(self.attribute_index), self.size), dtype=np.int64)
+        self.codes = {}
+        self.values = {}
+        self.cardinality = {}
+        for row, attribute in enumerate(self.attribute_index):
+            column = np.array([data[attribute] for data in dataset], dtype=str)
+            values, codes = np.unique(column, return_inverse=True)
+            self.columns[row] = codes
+            self.codes[attribute] = self.columns[row]
+            self.values[attribute] = values
+            self.cardinality[attribute] = len(values)
+        self.set_layout()
+
+        # Mondrian checks the partition size on distinct records, only pay for it when duplicates exist
+        row_id = {}
+        self.row_codes = np.array([row_id.setdefault(data, len(row_id)) for data in dataset], dtype=np.int64)
+        self.has_duplicates = len(row_id) < len(dataset)
+
+    @classmethod
+    def from_columns(cls, columns, attribute_index, cardinality, has_duplicates, k, metrics=None):
+        """
+        build an engine on already encoded columns, used by the pool workers
+        :param columns: 2d array, one row of codes per quasi-identifier followed by the row codes
+        """
+        engine = cls.__new__(cls)
+        engine.dataset = None
+        engine.size = columns.shape[1]
+        engine.attribute_index = list(attribute_index)
+        engine.k = k
+        engine.metrics = metrics
+        engine.columns = columns[:len(engine.attribute_index)]
+        engine.codes = {attribute: columns[i] for i, attribute in enumerate(engine.attribute_index)}
+        engine.values = None
+        engine.cardinality = dict(cardinality)
+        engine.set_layout()
+        engine.row_codes = columns[-1]
+        engine.has_duplicates = has_duplicates
+        return engine
+
+    def set_layout(self):
+        # row of every quasi-identifier in columns, and the offsets of their codes in a summary
+        self.rows = {attribute: row for row, attribute in enumerate(self.attribute_index)}
+        cardinality = [self.cardinality[attribute] for attribute in self.attribute_index]
+        self.offsets = np.concatenate([[0], np.cumsum(cardinality)]).astype(np.int64)
+
+    def distinct_records(self, index):
+        """
+        number of distinct records of a partition, same as len(set(partition))
+        """
+        if not self.has_duplicates:
+            return len(index)
+        return len(np.unique(self.row_codes[index]))
+
+    def select_attribute(self, summary, attribute_index):
+        """
+        select the attribute with the most distinct values, the first one wins on a tie
+        """
+        bounds = summary[2]
+        distinct = (bounds[1:] - bounds[:-1]).tolist()
+        return max(attribute_index, key=lambda attribute: distinct[self.rows[attribute]])
+
+    def split(self, index, attribute_index, summary=None):
+        """
+        Mondrian split of one partition, attributes which can not split it are dropped as in
+        Process.mondrian_process
+        :param summary: histograms of the partition, counted from the records when not given
+        :return: (data1, data2, attribute_index, attribute, split_value, summary1, summary2) or None when the
+            partition is a leaf, data1 holds the records whose code of attribute is <= split_value
+        """
+        k = self.k
+        while True:
+            if any([len(index) < 2*k, len(attribute_index) == 0]):
+                return None
+            if summary is None:
+                summary = partition_summary(self, index)
+
+            attribute = self.select_attribute(summary, attribute_index)
+            row = self.rows[attribute]
+            start, stop = summary[2][row], summary[2][row + 1]
+            # the median is the ceil(n/2)-th smallest value, read from the cumulative histogram
+            position = summary[1][start:stop].cumsum().searchsorted((len(index) + 1) // 2)
+            split_value = summary[0][start + position] - self.offsets[row]
+
+            mask = self.codes[attribute][index] <= split_value
+            data1 = index[mask]
+            data2 = index[~mask]
+
+            if any([self.distinct_records(data1) < k, self.distinct_records(data2) < k]):
+                attribute_index = list(attribute_index)
+                attribute_index.remove(attribute)
+                continue
+
+            # halves which are leaves only need a summary for the metrics
+            summary1, summary2 = None, None
+            if self.metrics is not None or max(len(data1), len(data2)) >= 2*k:
+                summary1, summary2 = split_summary(self, summary, data1, data2)
+            return data1, data2, attribute_index, attribute, split_value, summary1, summary2
+
+    def expand(self, item):
+        """
+        split both halves of a split partition
+        :return: the work-stack items of the halves, in push order
+        """
+        data1, data2, attribute_index = item[:3]
+        summary1, summary2 = item[5:7]
+        split1 = self.split(data1, attribute_index, summary1)
+        split2 = self.split(data2, attribute_index, summary2)
+        items = [[data for data, split in ((data1, split1), (data2, split2)) if split is None]]
+        if self.metrics is not None:
+            for data, summary, split in ((data1, summary1, split1), (data2, summary2, split2)):
+                if split is None:
+                    self.metrics.add_class(len(data), summary)
+        if split2 is not None:
+            items.append(split2)
+        if split1 is not None:
+            items.append(split1)
+        return items
+
+    def iter_subtree(self, item):
+        """
+        Mondrian algorithm driven by an explicit work-stack instead of recursion.
+        Yields the partitions below a split as arrays of row indices, in the order of
+        Process.mondrian_process: the leaves of a split are emitted after the subtrees of both halves.
+        """
+        stack = [item]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, list):
+                yield from item
+                continue
+            stack.extend(self.expand(item))
+
+    def split_root(self):
+        index = np.arange(self.size)
+        summary = partition_summary(self, index)
+        if self.metrics is not None:
+            self.metrics.bind(self, summary)
+        return self.split(index, self.attribute_index, summary)
+
+    def iter_partitions(self):
+        """
+        run Mondrian on the whole dataset, a dataset which can not be split at all yields nothing
+        """
+        root = self.split_root()
+        if root is not None:
+            yield from self.iter_subtree(root)
+
+    def iter_partitions_parallel(self, workers=None, threshold=default_parallel_threshold):
+        """
+        Parallel Mondrian, the halves of a split are independent so their subtrees run in a process pool.
+        The top of the tree is split here until the partitions are small enough to balance the workers,
+        then every partition with at least threshold records is sent to the pool and smaller ones are
+        processed in place. The encoded columns are shared with the workers through shared memory.
+        Yields the same partitions, in the same order, as iter_partitions.
+        :param workers: number of worker processes, default the number of cpus
+        :param threshold: minimum size of a partition sent to the pool
+        """
+        root = self.split_root()
+        if root is None:
+            return
+
+        workers = workers or os.cpu_count()
+        chunk = max(threshold, -(-self.size // (4 * workers)))
+        columns = [self.codes[attribute] for attribute in self.attribute_index] + [self.row_codes]
+        memory = SharedMemory(create=True, size=max(1, len(columns) * self.size * 8))
+        shared = None
+        try:
+            shared = np.ndarray((len(columns), self.size), dtype=np.int64, buffer=memory.buf)
+            shared[:] = columns
+            initargs = (memory.name, shared.shape, self.attribute_index, self.cardinality,
+                        self.has_duplicates, self.k, self.metrics)
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as executor:
+                # segments in output order, either partitions or the future of a subtree
+                segments = []
+                stack = [root]
+                while stack:
+                    item = stack.pop()
+                    if isinstance(item, list):
+                        segments.append(item)
+                        continue
+                    size = len(item[0]) + len(item[1])
+                    if size > chunk:
+                        stack.extend(self.expand(item))
+                    elif size >= threshold:
+                        segments.append(executor.submit(partition_subtree, item))
+                    else:
+                        segments.append(list(self.iter_subtree(item)))
+
+                for segment in segments:
+                    if isinstance(segment, list):
+                        yield from segment
+                    else:
+                        partitions, state = segment.result()
+                        if self.metrics is not None:
+                            self.metrics.merge(state)
+                        yield from partitions
+        finally:
+            # the view has to be released before the buffer can be closed
+            shared = None
+            memory.close()
+            memory.unlink()
+
+
+def init_worker(name, shape, attribute_index, cardinality, has_duplicates, k, metrics):
+    """
+    attach a pool worker to the shared column buffer
+    """
+    global _WORKER_ENGINE, _WORKER_MEMORY
+    _WORKER_MEMORY = SharedMemory(name=name)
+    columns = np.ndarray(shape, dtype=np.int64, buffer=_WORKER_MEMORY.buf)
+    _WORKER_ENGINE = NumpyMondrian.from_columns(columns, attribute_index, cardinality, has_duplicates, k,
+                                               metrics)
+
+
+def partition_subtree(item):
+    """
+    pool task, partitions the subtree below a split
+    :return: the partitions and the state of the metrics of their classes
+    """
+    metrics = _WORKER_ENGINE.metrics
+    if metrics is not None:
+        metrics.reset()
+    partitions = list(_WORKER_ENGINE.iter_subtree(item))
+    return partitions, None if metrics is None else metrics.state()
@@ -0,0 +1,198 @@
+import os
+import random
+import tempfile
+
+import numpy as np
+
+from mondrian_numpy import NumpyMondrian, default_parallel_threshold
+
+
+default_partition_size = 500000
+default_sample_size = 100000
+default_spill_buffer = 10000
+
+
+def read_spill_file(file):
+    """
+    read the records of a partition file back, same parsing as FileHandle.read_source_data
+    """
+    with open(file, "r") as fr:
+        return [tuple(line.strip().split(",")) for line in fr if line.strip()]
+
+
+class StreamingMondrian(object):
+    """
+    Out-of-core Mondrian for inputs larger than memory.
+    A sample of the records chooses the top-level cuts, then every record is routed down the
+    cuts into an on-disk partition file and each partition is anonymized on its own.
+    Only one partition is held in memory at a time.
+    """
+
+    def __init__(self, attribute_index, k, partition_size=default_partition_size,
+                 sample_size=default_sample_size, seed=None, work_dir=None):
+        """
+        :param attribute_index: indices of the quasi-identifier columns
+        :param k: k value of the k-anonymity
+        :param partition_size: maximum expected number of records of a partition file
+        :param sample_size: number of records sampled to choose the cuts
+        :param seed: seed of the reservoir sampling
+        :param work_dir: folder of the partition files, default the system temp folder
+        """
+        self.attribute_index = list(attribute_index)
+        self.k = k
+        self.partition_size = partition_size
+        self.sample_size = sample_size
+        self.random = random.Random(seed)
+        self.work_dir = work_dir
+        # cut tree, a leaf is a partition number, a node is (attribute, split_value, left, right)
+        self.cuts = 0
+        self.partition_count = 1
+
+    def sample(self, records):
+        """
+        reservoir sample of a record stream
+        :return: sample and total number of records
+        """
+        sample = []
+        total = 0
+        for record in records:
+            total += 1
+            if len(sample) < self.sample_size:
+                sample.append(record)
+            else:
+                position = self.random.randrange(total)
+                if position < self.sample_size:
+                    sample[position] = record
+        return sample, total
+
+    def fit(self, records):
+        """
+        choose the top-level cuts with Mondrian median splits of a sample, until the expected
+        size of every partition is at most partition_size
+        """
+        sample, total = self.sample(records)
+        self.cuts = 0
+        self.partition_count = 1
+        if total <= self.partition_size or not sample:
+            return self
+
+        scale = total / len(sample)
+        engine = NumpyMondrian(sample, self.attribute_index, 1)
+        self.cuts = self.build_cuts(engine, scale)
+        return self
+
+    def build_cuts(self, engine, scale):
+        """
+        build the cut tree on the sample with a work-stack
+        """
+        self.partition_count = 0
+        root = [None]
+        # each item is the sample index of a node, the slot (list, position) which receives the node and its summary
+        stack = [(np.arange(engine.size), engine.attribute_index, root, 0, None)]
+        while stack:
+            index, attribute_index, parent, position, summary = stack.pop()
+            split = None
+            if len(index) * scale > self.partition_size:
+                split = engine.split(index, attribute_index, summary)
+            if split is None:
+                parent[position] = self.partition_count
+                self.partition_count += 1
+                continue
+
+            data1, data2, attribute_index, attribute, split_value, summary1, summary2 = split
+            node = [attribute, engine.values[attribute][split_value], None, None]
+            parent[position] = node
+            stack.append((data2, attribute_index, node, 3, summary2))
+            stack.append((data1, attribute_index, node, 2, summary1))
+        return self.freeze(root[0])
+
+    def freeze(self, node):
+        if isinstance(node, int):
+            return node
+        return node[0], str(node[1]), self.freeze(node[2]), self.freeze(node[3])
+
+    def route(self, record):
+        """
+        number of the partition file a record belongs to
+        """
+        node = self.cuts
+        while not isinstance(node, int):
+            attribute, split_value, left, right = node
+            node = left if record[attribute] <= split_value else right
+        return node
+
+    def spill(self, records, folder):
+        """
+        write every record into its partition file
+        :return: list of the partition files and their number of records
+        """
+        files = [os.path.join(folder, "partition_%d.csv" % i) for i in range(self.partition_count)]
+        counts = [0] * self.partition_count
+        buffers = [[] for _ in range(self.partition_count)]
+        for record in records:
+            number = self.route(record)
+            buffers[number].append(",".join(record))
+            counts[number] += 1
+            if len(buffers[number]) >= default_spill_buffer:
+                self.flush(files[number], buffers[number])
+        for file, buffer in zip(files, buffers):
+            self.flush(file, buffer)
+        return files, counts
+
+    @staticmethod
+    def flush(file, buffer):
+        with open(file, "a") as fw:
+            for line in buffer:
+                fw.write(line + "\n")
+        buffer.clear()
+
+    def group(self, counts):
+        """
+        group neighbouring partitions so that every group holds at least k records
+        """
+        groups = []
+        current = []
+        current_count = 0
+        for number, count in enumerate(counts):
+            if count == 0:
+                continue
+            current.append(number)
+            current_count += count
+            if current_count >= self.k:
+                groups.append(current)
+                current = []
+                current_count = 0
+        if current:
+            if groups:
+                groups[-1].extend(current)
+            else:
+                groups.append(current)
+        return groups
+
+    def iter_partitions(self, records, workers=None, threshold=default_parallel_threshold):
+        """
+        spill the records and run Mondrian on every partition file
+        :param records: record stream, it is read once by this call
+        :return: generator of the equivalence classes, each one a list of records
+        """
+        with tempfile.TemporaryDirectory(dir=self.work_dir) as folder:
+            files, counts = self.spill(records, folder)
+            for group in self.group(counts):
+                dataset = []
+                for number in group:
+                    dataset.extend(read_spill_file(files[number]))
+                    os.remove(files[number])
+                if len(dataset) < self.k:
+                    # not enough records for a single class in the whole input
+                    return
+
+                engine = NumpyMondrian(dataset, self.attribute_index, self.k)
+                if workers:
+                    partitions = list(engine.iter_partitions_parallel(workers, threshold))
+                else:
+                    partitions = list(engine.iter_partitions())
+                if not partitions:
+                    # a partition which can not be split is one equivalence class
+                    yield dataset
+                for index in partitions:
+                    yield [dataset[i] for i in index]
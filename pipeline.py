@@ -0,0 +1,256 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+import pandas as pd
+
+root = os.path.dirname(os.path.abspath(__file__))
+for folder in ["data_processing", "k-anonymization", "Index"]:
+    sys.path.insert(0, os.path.join(root, folder))
+
+import data_cleaning
+import instrumentation
+import load_data
+import Index
+import classification
+import Mondran
+
+default_cache_dir = os.path.join(root, ".pipeline_cache")
+default_combined_file = os.path.join(root, "datasets", "combined_data.csv")
+default_adult_file = os.path.join(root, "datasets", "adult.csv")
+default_noise_columns = ['given_name', 'surname', 'address_1', 'address_2', 'suburb', 'state']
+# bump the version of a stage when its code changes the output, it invalidates the cached results
+stage_versions = {
+    "load": 1,
+    "clean": 2,
+    "merge": 2,
+    "process": 1,
+    "split": 1,
+    "noise": 1,
+    "anonymize": 1,
+    "link": 1,
+    "classify": 1,
+}
+
+
+class Pipeline(object):
+    """
+    End-to-end pipeline from the source csv files to the linkage results.
+    Every stage is fingerprinted by its inputs and parameters, and its outputs are kept in a
+    content-addressed cache folder, so a run only recomputes the stages downstream of a change.
+    """
+
+    def __init__(self, cache_dir=default_cache_dir, **kwargs):
+        self.cache_dir = cache_dir
+        self.source_folder = kwargs.get("source_folder")
+        self.combined_file = kwargs.get("combined_file") or default_combined_file
+        self.adult_file = kwargs.get("adult_file") or default_adult_file
+        self.merge_seed = kwargs.get("merge_seed", 0)
+        self.noise_seed = kwargs.get("noise_seed", 0)
+        self.noise_rate = kwargs.get("noise_rate", 0.2)
+        self.noise_columns = kwargs.get("noise_columns") or default_noise_columns
+        self.k = kwargs.get("k", Mondran.default_k)
+        self.attribute_index = kwargs.get("attribute_index") or Mondran.default_quality_index
+        self.engine = kwargs.get("engine", "numpy")
+        self.output_format = kwargs.get("output_format", "csv")
+        self.threshold = kwargs.get("threshold", 4.5)
+        self.blocking = kwargs.get("blocking", "block")
+        # model of the supervised re-classification of the possible matches, None skips the stage
+        self.classifier = kwargs.get("classifier")
+        self.classifier_seed = kwargs.get("classifier_seed", 0)
+        self.executed = []
+
+    def fingerprint(self, name, inputs, params):
+        """
+        key of a stage run: its version, parameters and the identity of its inputs.
+        An input from the cache is identified by its path, which holds the key of the stage
+        that produced it, any other input by the digest of its content.
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps([name, stage_versions[name], params], sort_keys=True).encode())
+        for key in sorted(inputs):
+            path = os.path.abspath(inputs[key])
+            digest.update(key.encode())
+            if path.startswith(os.path.abspath(self.cache_dir) + os.sep):
+                digest.update(path.encode())
+            else:
+                digest.update(file_digest(path).encode())
+        return digest.hexdigest()[:16]
+
+    def stage(self, name, inputs, params, outputs, run):
+        """
+        run a stage unless its outputs are cached
+        :param inputs: dict of input name to path
+        :param params: json-serializable parameters of the stage
+        :param outputs: list of output file names
+        :param run: function(inputs, output paths) writing the outputs
+        :return: dict of output name to cached path
+        """
+        folder = os.path.join(self.cache_dir, name, self.fingerprint(name, inputs, params))
+        paths = {output: os.path.join(folder, output) for output in outputs}
+        if os.path.isdir(folder):
+            print(f"stage {name} is cached: {folder}")
+            return paths
+
+        tmp_folder = folder + ".tmp"
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        os.makedirs(tmp_folder)
+        with instrumentation.stage("pipeline." + name):
+            run(inputs, {output: os.path.join(tmp_folder, output) for output in outputs})
+        missing = [output for output in outputs if not os.path.exists(os.path.join(tmp_folder, output))]
+        if missing:
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+            raise RuntimeError(f"stage {name} did not write {missing}")
+        os.replace(tmp_folder, folder)
+        self.executed.append(name)
+        return paths
+
+    def run(self):
+        if self.source_folder:
+            combined = self.stage(
+                "load", {}, {"source_folder": os.path.abspath(self.source_folder),
+                             "files": folder_digest(self.source_folder)},
+                ["combined_data.csv"],
+                lambda inputs, outputs: load_data.load_data(self.source_folder, outputs["combined_data.csv"]),
+            )["combined_data.csv"]
+        else:
+            combined = self.combined_file
+
+        cleaned = self.stage(
+            "clean", {"combined": combined}, {}, ["cleaned_data.csv"],
+            lambda inputs, outputs: data_cleaning.clean_data(inputs["combined"], outputs["cleaned_data.csv"]),
+        )["cleaned_data.csv"]
+
+        merged = self.stage(
+            "merge", {"cleaned": cleaned, "adult": self.adult_file}, {"seed": self.merge_seed},
+            ["merged_data.csv"],
+            lambda inputs, outputs: data_cleaning.merge_data(inputs["cleaned"], inputs["adult"],
+                                                             outputs["merged_data.csv"], seed=self.merge_seed),
+        )["merged_data.csv"]
+
+        processed = self.stage(
+            "process", {"merged": merged}, {}, ["processed_data.csv"],
+            lambda inputs, outputs: data_cleaning.process_merged_data(inputs["merged"],
+                                                                      outputs["processed_data.csv"]),
+        )["processed_data.csv"]
+
+        split = self.stage(
+            "split", {"processed": processed}, {}, ["dataset_a.csv", "dataset_b.csv"],
+            lambda inputs, outputs: data_cleaning.split_and_remove_duplicates(
+                inputs["processed"], outputs["dataset_a.csv"], outputs["dataset_b.csv"]),
+        )
+
+        noise_params = {"seed": self.noise_seed, "rate": self.noise_rate, "columns": self.noise_columns}
+        noisy = self.stage(
+            "noise", {"dataset_a": split["dataset_a.csv"], "dataset_b": split["dataset_b.csv"]}, noise_params,
+            ["dataset_a.csv", "dataset_b.csv"], self.run_noise,
+        )
+
+        anonymize_params = {"k": self.k, "attribute_index": self.attribute_index, "engine": self.engine,
+                            "output_format": self.output_format}
+        suffix = "." + self.output_format
+        anonymized = self.stage(
+            "anonymize", {"dataset_a": noisy["dataset_a.csv"], "dataset_b": noisy["dataset_b.csv"]},
+            anonymize_params, ["output_dataset_a" + suffix, "output_dataset_b" + suffix], self.run_anonymize,
+        )
+
+        linked = self.stage(
+            "link", {"dataset_a": anonymized["output_dataset_a" + suffix],
+                     "dataset_b": anonymized["output_dataset_b" + suffix]},
+            {"threshold": self.threshold, "blocking": self.blocking},
+            ["comparison_result.csv", "match.csv", "possible_match.csv", "not_match.csv"],
+            lambda inputs, outputs: Index.link_records(inputs["dataset_a"], inputs["dataset_b"], self.threshold,
+                                                       os.path.dirname(outputs["match.csv"]), self.blocking),
+        )
+        if self.classifier:
+            linked.update(self.stage(
+                "classify", {"comparison_result": linked["comparison_result.csv"]},
+                {"threshold": self.threshold, "model": self.classifier, "seed": self.classifier_seed},
+                ["model.joblib", "reclassified.csv"], self.run_classify,
+            ))
+        return linked
+
+    def run_noise(self, inputs, outputs):
+        for name in ["dataset_a", "dataset_b"]:
+            output = outputs[name + ".csv"]
+            shutil.copyfile(inputs[name], output)
+            # a different seed per dataset, the two halves must not get the same edits
+            seed = None if self.noise_seed is None else [self.noise_seed, name == "dataset_b"]
+            data_cleaning.add_noise_to_data(output, self.noise_columns, rate=self.noise_rate, seed=seed)
+
+    def run_classify(self, inputs, outputs):
+        comparison_result = pd.read_csv(inputs["comparison_result"], index_col=[0, 1])
+        classifier = classification.MatchClassifier(self.classifier, self.classifier_seed)
+        classifier.fit(comparison_result, self.threshold)
+        classifier.save(outputs["model.joblib"])
+        classifier.reclassify(comparison_result, self.threshold).to_csv(outputs["reclassified.csv"])
+
+    def run_anonymize(self, inputs, outputs):
+        suffix = "." + self.output_format
+        for name in ["dataset_a", "dataset_b"]:
+            process = Mondran.Process(input_file=inputs[name], output_file=outputs["output_" + name + suffix],
+                                      attribute_index=self.attribute_index, k=self.k, engine=self.engine,
+                                      output_format=self.output_format)
+            process.main()
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fr:
+        for block in iter(lambda: fr.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def folder_digest(folder):
+    return {file: file_digest(os.path.join(folder, file)) for file in sorted(os.listdir(folder)) if file.endswith(".csv")}
+
+
+if __name__ == '__main__':
+    # python pipeline.py --k 3 --quality_index 3,7,8,9 --threshold 4.5
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source_folder', default=None, help='input the folder of the source csv files, '
+                                                              'default starts from the combined data.')
+    parser.add_argument('--combined_file', default=default_combined_file, help='input the combined data.')
+    parser.add_argument('--adult_file', default=default_adult_file, help='input the adult data.')
+    parser.add_argument('--cache_dir', default=default_cache_dir, help='input the folder of the stage cache.')
+    parser.add_argument('--merge_seed', type=int, default=0, help='input the seed of the adult data merge.')
+    parser.add_argument('--noise_seed', type=int, default=0, help='input the seed of the noise.')
+    parser.add_argument('--noise_rate', type=float, default=0.2, help='input the rate of noisy rows per column.')
+    parser.add_argument('--k', type=int, default=Mondran.default_k, help='input the K')
+    parser.add_argument('--quality_index', default=",".join(map(str, Mondran.default_quality_index)),
+                        help='input the quality_index, for example: 3,7,8,9.')
+    parser.add_argument('--engine', default='numpy', choices=['python', 'numpy'], help='input the Mondrian engine.')
+    parser.add_argument('--output_format', default='csv', choices=['csv', 'npy'],
+                        help='input the format of the anonymized data.')
+    parser.add_argument('--threshold', type=float, default=4.5, help='input the match threshold.')
+    parser.add_argument('--blocking', default='block', choices=Index.blocking_methods,
+                        help='input the blocking, block pairs records sharing a postcode bound, interval every '
+                             'record pair with overlapping postcode ranges.')
+    parser.add_argument('--classifier', default=None, choices=classification.classifier_models,
+                        help='input the model which labels the possible matches again, default skips it.')
+    parser.add_argument('--classifier_seed', type=int, default=0, help='input the random state of the model.')
+    parser.add_argument('--report', default=None,
+                        help='input the json file of the stage timings, default the LINKAGE_REPORT variable.')
+    parser.add_argument('--profile', default=None,
+                        help='input the profilers to run, cprofile and/or tracemalloc, for example: '
+                             'cprofile,tracemalloc. Default the LINKAGE_PROFILE variable.')
+    args = parser.parse_args()
+    try:
+        instrumentation.configure(args.report, instrumentation.parse_profile(args.profile))
+    except ValueError as error:
+        parser.error(str(error))
+
+    pipeline = Pipeline(cache_dir=args.cache_dir, source_folder=args.source_folder, combined_file=args.combined_file,
+                        adult_file=args.adult_file, merge_seed=args.merge_seed, noise_seed=args.noise_seed,
+                        noise_rate=args.noise_rate, k=args.k,
+                        attribute_index=[int(item.strip()) for item in args.quality_index.split(",")],
+                        engine=args.engine, output_format=args.output_format, threshold=args.threshold,
+                        blocking=args.blocking, classifier=args.classifier, classifier_seed=args.classifier_seed)
+    result = pipeline.run()
+    print(f"executed stages: {pipeline.executed}")
+    print(f"linkage results: {os.path.dirname(result['match.csv'])}")
+    instrumentation.finish()
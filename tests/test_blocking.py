@@ -0,0 +1,75 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "Index"))
+
+import Index
+
+
+def create_multi_index_loop(df_a, df_b, pairs):
+    # the per-pair loop create_multi_index replaced
+    matching_pairs = []
+    for i, j in pairs:
+        a_min, a_max = df_a.loc[i, ['postcode_min', 'postcode_max']]
+        b_min, b_max = df_b.loc[j, ['postcode_min', 'postcode_max']]
+        if a_min < b_max and b_min < a_max:
+            matching_pairs.append((df_a.index[i], df_b.index[j]))
+    return pd.MultiIndex.from_tuples(matching_pairs, names=['index_a', 'index_b'])
+
+
+def postcode_ranges(rng, size):
+    low = rng.integers(2000, 2100, size)
+    return pd.DataFrame({'postcode_min': low, 'postcode_max': low + rng.integers(0, 20, size)})
+
+
+class CreateMultiIndexTest(unittest.TestCase):
+    """
+    The vectorized range filter keeps the same pairs, in the same order, as the per-pair loop.
+    """
+
+    def test_matches_the_loop(self):
+        rng = np.random.default_rng(0)
+        df_a = postcode_ranges(rng, 300)
+        df_b = postcode_ranges(rng, 200)
+        pairs = pd.MultiIndex.from_arrays([rng.integers(0, len(df_a), 5000), rng.integers(0, len(df_b), 5000)])
+
+        expected = create_multi_index_loop(df_a, df_b, pairs)
+        result = Index.create_multi_index(df_a, df_b, pairs)
+        self.assertGreater(len(expected), 0)
+        self.assertLess(len(expected), len(pairs))
+        self.assertTrue(result.equals(expected))
+        self.assertEqual(list(result.names), ['index_a', 'index_b'])
+
+    def test_no_overlap(self):
+        df_a = pd.DataFrame({'postcode_min': [2000, 2010], 'postcode_max': [2005, 2020]})
+        df_b = pd.DataFrame({'postcode_min': [2005, 2030], 'postcode_max': [2010, 2040]})
+        pairs = pd.MultiIndex.from_product([range(2), range(2)])
+        self.assertEqual(len(Index.create_multi_index(df_a, df_b, pairs)), 0)
+
+
+class IntervalOverlapTest(unittest.TestCase):
+    """
+    The interval blocking pairs exactly the records with overlapping postcode ranges.
+    """
+
+    def test_all_overlapping_pairs(self):
+        rng = np.random.default_rng(1)
+        df_a = postcode_ranges(rng, 300)
+        df_b = postcode_ranges(rng, 200)
+        pairs = pd.MultiIndex.from_product([range(len(df_a)), range(len(df_b))])
+
+        expected = Index.create_multi_index(df_a, df_b, pairs)
+        result = Index.block_records(df_a, df_b, 'interval')
+        self.assertTrue(result.equals(expected))
+        self.assertEqual(list(result.names), ['index_a', 'index_b'])
+        self.assertTrue(Index.block_records(df_a, df_b).isin(result).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
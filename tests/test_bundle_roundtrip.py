@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import pandas as pd
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+for folder in ["k-anonymization", "Index"]:
+    sys.path.insert(0, os.path.join(root, folder))
+
+import Index
+import Mondran
+
+dataset_a_file = os.path.join(root, "datasets", "datasetsA", "dataset_a.csv")
+dataset_b_file = os.path.join(root, "datasets", "datasetsB", "dataset_b.csv")
+
+
+class BundleRoundTripTest(unittest.TestCase):
+    """
+    The .npy bundle of the anonymizer links exactly like its csv output.
+    """
+
+    def anonymize(self, folder, output_format):
+        outputs = []
+        for name, input_file in [("dataset_a", dataset_a_file), ("dataset_b", dataset_b_file)]:
+            output_file = os.path.join(folder, "output_" + name + "." + output_format)
+            Mondran.Process(input_file=input_file, output_file=output_file, k=Mondran.default_k,
+                            attribute_index=Mondran.default_quality_index, engine="numpy",
+                            output_format=output_format).main()
+            outputs.append(output_file)
+        return outputs
+
+    def test_csv_and_npy_give_the_same_linkage(self):
+        with tempfile.TemporaryDirectory() as folder:
+            csv_result = Index.link_records(*self.anonymize(folder, "csv"), 4.5)
+            npy_result = Index.link_records(*self.anonymize(folder, "npy"), 4.5)
+
+        self.assertGreater(len(csv_result["comparison_result"]), 0)
+        pd.testing.assert_frame_equal(csv_result["comparison_result"], npy_result["comparison_result"])
+        for name in ["match", "possible_match", "not_match"]:
+            pd.testing.assert_frame_equal(csv_result[name], npy_result[name])
+
+
+if __name__ == "__main__":
+    unittest.main()
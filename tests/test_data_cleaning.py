@@ -0,0 +1,80 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "data_processing"))
+
+import data_cleaning
+
+
+def impute_loop(data):
+    # the iterrows imputation impute_by_soc_sec_id replaced
+    for index, row in data.iterrows():
+        if row.isnull().any():
+            soc_soe_id = row[' soc_sec_id']
+            same_soc_soe_id_rows = data[data[' soc_sec_id'] == soc_soe_id]
+            if len(same_soc_soe_id_rows) == 1:
+                data = data.drop(index)
+            else:
+                nan_columns = row[row.isnull()].index.tolist()
+                for column in nan_columns:
+                    other_values = same_soc_soe_id_rows[column].dropna()
+                    if len(other_values) == 0:
+                        data = data[data[' soc_sec_id'] != soc_soe_id]
+                        break
+                    else:
+                        data.at[index, column] = other_values.mode()[0]
+    return data
+
+
+class ImputeBySocSecIdTest(unittest.TestCase):
+    """
+    The groupby imputation keeps and fills the same rows as the iterrows loop.
+    """
+
+    def check(self, data):
+        expected = impute_loop(data.copy())
+        result = data_cleaning.impute_by_soc_sec_id(data.copy())
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    def test_tied_modes_and_missing_groups(self):
+        nan = np.nan
+        data = pd.DataFrame({
+            ' soc_sec_id': [1, 1, 1, 1, 2, 2, 3, 4, 4, 5, 5, 5],
+            'surname': ['b', 'a', nan, 'b', 'x', nan, nan, 'p', 'q', nan, nan, nan],
+            ' postcode': [2000, 2001, 2001, nan, nan, nan, 2600, 2700, nan, 2800, 2800, 2900],
+        })
+        self.check(data)
+
+    def test_missing_ids(self):
+        nan = np.nan
+        data = pd.DataFrame({
+            ' soc_sec_id': [1, nan, 1, nan, 2, 2],
+            'surname': ['a', nan, nan, 'z', 'c', 'c'],
+            ' postcode': [2000, 2100, 2000, nan, 2200, nan],
+        })
+        self.check(data)
+
+    def test_random_frames(self):
+        rng = np.random.default_rng(0)
+        for seed in range(20):
+            size = 60
+            data = pd.DataFrame({
+                ' soc_sec_id': rng.integers(0, 20, size).astype(float),
+                'surname': rng.choice(['a', 'b', 'c'], size).astype(object),
+                ' postcode': rng.integers(2000, 2003, size).astype(float),
+            })
+            data.loc[rng.random(size) < 0.05, ' soc_sec_id'] = np.nan
+            data.loc[rng.random(size) < 0.2, 'surname'] = np.nan
+            data.loc[rng.random(size) < 0.2, ' postcode'] = np.nan
+            with self.subTest(seed=seed):
+                self.check(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
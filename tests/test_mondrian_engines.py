@@ -0,0 +1,65 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "k-anonymization"))
+
+import Mondran
+
+dataset_b_file = os.path.join(root, "datasets", "datasetsB", "dataset_b.csv")
+
+
+class MondrianEngineTest(unittest.TestCase):
+    """
+    The numpy engine writes the same anonymized dataset as the python engine, and the streaming mode
+    keeps no output with a class smaller than k.
+    """
+
+    def anonymize(self, folder, engine, k, **kwargs):
+        output_file = os.path.join(folder, engine + "_" + str(k) + ".csv")
+        Mondran.Process(input_file=dataset_b_file, output_file=output_file, k=k,
+                        attribute_index=Mondran.default_quality_index, engine=engine, **kwargs).main()
+        with open(output_file) as fr:
+            return fr.read()
+
+    def test_numpy_engine_matches_python_engine(self):
+        with tempfile.TemporaryDirectory() as folder:
+            for k in [2, 3, 5, 10]:
+                with self.subTest(k=k):
+                    expected = self.anonymize(folder, "python", k)
+                    self.assertGreater(len(expected.splitlines()), 1)
+                    self.assertEqual(expected, self.anonymize(folder, "numpy", k))
+
+    def test_parallel_mode_matches_python_engine(self):
+        # a low threshold sends most of the partitions of the 1000 records to the worker processes
+        with tempfile.TemporaryDirectory() as folder:
+            for k in [2, 3, 5]:
+                with self.subTest(k=k):
+                    expected = self.anonymize(folder, "python", k)
+                    self.assertEqual(expected, self.anonymize(folder, "numpy", k, workers=2, parallel_threshold=20))
+
+    def test_streaming_refuses_a_class_smaller_than_k(self):
+        # the streaming partitions with a class of two records for k 3
+        def iter_partitions(streaming, records, workers=None, threshold=None):
+            records = list(records)
+            yield records[:2]
+            yield records[2:]
+
+        with tempfile.TemporaryDirectory() as folder:
+            output_file = os.path.join(folder, "streaming.csv")
+            process = Mondran.Process(input_file=dataset_b_file, output_file=output_file, k=3,
+                                      attribute_index=Mondran.default_quality_index, streaming=True)
+            with mock.patch.object(Mondran.StreamingMondrian, "iter_partitions", iter_partitions):
+                process.main()
+            self.assertFalse(os.path.exists(output_file))
+
+            process.main()
+            self.assertTrue(os.path.exists(output_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+import recordlinkage as rl
+from recordlinkage.index import Block
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "Index"))
+
+from string_similarity import CompareCachedString, string_methods
+
+dataset_a_file = os.path.join(root, "datasets", "datasetsA", "dataset_a.csv")
+dataset_b_file = os.path.join(root, "datasets", "datasetsB", "dataset_b.csv")
+columns = ['given_name', 'surname', 'address_1', 'suburb']
+
+
+class CompareCachedStringTest(unittest.TestCase):
+    """
+    CompareCachedString gives the similarities of recordlinkage's Compare.string, also when the
+    caches are too small for the values and pairs of a batch.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df_a = pd.read_csv(dataset_a_file)
+        cls.df_b = pd.read_csv(dataset_b_file)
+        # a few missing values, Compare.string gives them the missing_value
+        cls.df_a.loc[::50, 'surname'] = np.nan
+        indexer = rl.Index()
+        indexer.add(Block('postcode'))
+        cls.multi_index = indexer.index(cls.df_a, cls.df_b)
+
+    def compare(self, method, cached, threshold=None):
+        comp = rl.Compare()
+        for column in columns:
+            if cached:
+                comp.add(CompareCachedString(column, column, method=method, threshold=threshold, label=column))
+            else:
+                comp.string(column, column, method=method, threshold=threshold, label=column)
+        return comp.compute(self.multi_index, self.df_a, self.df_b)
+
+    def test_methods(self):
+        self.assertGreater(len(self.multi_index), 0)
+        for method in string_methods:
+            with self.subTest(method=method):
+                expected = self.compare(method, cached=False)
+                result = self.compare(method, cached=True)
+                np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), atol=1e-9)
+
+    def test_small_caches(self):
+        expected = self.compare('jarowinkler', cached=False)
+        # fewer interned values and cached pairs than a batch has, and the batches of compare_in_batches
+        comp = rl.Compare()
+        for column in columns:
+            comp.add(CompareCachedString(column, column, method='jarowinkler', label=column, cache_size=100,
+                                         value_cache_size=50))
+        result = pd.concat([comp.compute(self.multi_index[start:start + 500], self.df_a, self.df_b)
+                            for start in range(0, len(self.multi_index), 500)])
+        np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), atol=1e-9)
+
+    def test_threshold(self):
+        expected = self.compare('levenshtein', cached=False, threshold=0.8)
+        result = self.compare('levenshtein', cached=True, threshold=0.8)
+        np.testing.assert_array_equal(result.to_numpy(), expected.to_numpy())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "Index"))
+
+import Index
+
+
+class ThresholdSweepTest(unittest.TestCase):
+    """
+    The counts of ThresholdSweep are the sizes of the categories of categorize_matches.
+    """
+
+    def check(self, comparison_result, thresholds):
+        counts = Index.ThresholdSweep(comparison_result.sum(axis=1)).counts(thresholds)
+        for threshold in thresholds:
+            categories = Index.categorize_matches(comparison_result, threshold)
+            with self.subTest(threshold=threshold):
+                self.assertEqual([len(index) for index in categories],
+                                 counts.loc[threshold, ['match', 'possible_match', 'not_match']].tolist())
+
+    def test_random_similarities(self):
+        rng = np.random.default_rng(0)
+        comparison_result = pd.DataFrame(rng.random((5000, 5), dtype=np.float32),
+                                         columns=['postcode', 'street_number', 'date_of_birth', 'state',
+                                                  'salary-class'])
+        self.check(comparison_result, np.linspace(0, 5, 101))
+
+    def test_scores_on_the_bounds(self):
+        # total similarities equal to a threshold and to the bounds of the possible matches
+        thresholds = [1.0, 2.5, 3.0, 4.5]
+        totals = sorted({value for threshold in thresholds
+                         for value in [threshold, threshold - 1, threshold - 0.1, threshold - 0.05]})
+        comparison_result = pd.DataFrame({'postcode': np.array(totals, dtype=np.float32),
+                                          'state': np.zeros(len(totals), dtype=np.float32)})
+        self.check(comparison_result, thresholds)
+
+
+if __name__ == "__main__":
+    unittest.main()